@@ -0,0 +1,174 @@
+import asyncio
+import os
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from Logger import Logger
+from ProxyManager import ProxyManager
+from SessionManager import SessionManager
+
+try:
+    from playwright.async_api import Route, TimeoutError as PlaywrightTimeoutError, async_playwright
+except ImportError:
+    async_playwright = None
+
+load_dotenv()
+
+SITE_URL = 'https://www.theperfumeshop.com/'
+
+
+class BrowserPool:
+    """
+    Warm pool of headless Chromium contexts, used to fetch pages that need a real browser.
+
+    Each context is bound to one proxy and presents that proxy's session fingerprint and cookies.
+    Images, fonts, stylesheets and media are blocked, and a context is replaced after a number of
+    uses or as soon as a fetch through it fails.
+    """
+    _instance = None
+    ENABLED = os.getenv('BROWSER_FETCH_ENABLED', 'false').lower() == 'true'
+    POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', 3))
+    CONTEXT_MAX_USES = int(os.getenv('BROWSER_CONTEXT_MAX_USES', 20))
+    NAVIGATION_TIMEOUT_SECONDS = int(os.getenv('BROWSER_NAVIGATION_TIMEOUT_SECONDS', 30))
+    BLOCKED_RESOURCE_TYPES = {'image', 'font', 'stylesheet', 'media'}
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(BrowserPool, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        self.playwright = None
+        self.browser = None
+        self.idle: Optional[asyncio.Queue] = None
+        self.size = 0
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def available(self) -> bool:
+        return self.ENABLED and async_playwright is not None
+
+    async def start(self) -> None:
+        """Launch the browser and warm up the pool on first use"""
+        if self.browser is not None:
+            return
+
+        async with self._start_lock:
+            if self.browser is not None:
+                return
+            if async_playwright is None:
+                raise RuntimeError("Playwright is not installed, run 'playwright install chromium' after installing it")
+
+            self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(headless=True)
+            self.idle = asyncio.Queue()
+            await asyncio.gather(*(self._add_context() for _ in range(self.POOL_SIZE)), return_exceptions=True)
+            Logger.info(f"Browser pool started with {self.size} contexts")
+
+    async def _add_context(self) -> None:
+        self.size += 1
+        try:
+            self.idle.put_nowait(await self._new_context())
+        except Exception as e:
+            self.size -= 1
+            Logger.error("Failed to create browser context", e)
+            raise
+
+    async def _new_context(self) -> Dict:
+        proxy_manager = ProxyManager()
+        await proxy_manager.initialize()
+        proxy = await proxy_manager.get_proxy()
+        session = SessionManager().get_session(proxy['http'])
+        fingerprint = session['fingerprint']
+
+        context = await self.browser.new_context(
+            proxy={
+                "server": f"http://{proxy['proxy_address']}:{proxy['port']}",
+                "username": proxy['username'],
+                "password": proxy['password']
+            },
+            user_agent=fingerprint['user-agent'],
+            extra_http_headers={'sec-ch-ua': fingerprint['sec-ch-ua']},
+            locale='en-GB'
+        )
+        if session['cookies']:
+            await context.add_cookies([
+                {"name": name, "value": value, "url": SITE_URL} for name, value in session['cookies'].items()
+            ])
+        await context.route('**/*', self._block_resources)
+        return {"context": context, "proxy": proxy, "uses": 0}
+
+    async def _block_resources(self, route: 'Route') -> None:
+        if route.request.resource_type in self.BLOCKED_RESOURCE_TYPES:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def fetch(self, url: str) -> Tuple[Dict[str, str], str]:
+        """Load a page in a pooled context and return the context's proxy with the rendered HTML"""
+        await self.start()
+        if self.idle.empty() and self.size < self.POOL_SIZE:
+            await self._add_context()
+
+        pooled = await self.idle.get()
+        pooled["uses"] += 1
+        try:
+            page = await pooled["context"].new_page()
+            try:
+                await page.goto(url, wait_until='domcontentloaded', timeout=self.NAVIGATION_TIMEOUT_SECONDS * 1000)
+                try:
+                    # A JS challenge navigates to the product page once solved
+                    await page.wait_for_selector(
+                        '#spartacus-app-state',
+                        state='attached',
+                        timeout=self.NAVIGATION_TIMEOUT_SECONDS * 1000
+                    )
+                except PlaywrightTimeoutError:
+                    Logger.warn(f"Product data did not appear in the browser for {url}")
+                content = await page.content()
+            finally:
+                await page.close()
+
+            cookies = await pooled["context"].cookies(SITE_URL)
+            SessionManager().update_cookies(pooled["proxy"]['http'], {cookie['name']: cookie['value'] for cookie in cookies})
+            return pooled["proxy"], content
+        except Exception:
+            # The proxy may be banned or the context broken, don't hand it out again
+            pooled["uses"] = self.CONTEXT_MAX_USES
+            raise
+        finally:
+            await self._recycle(pooled)
+
+    async def _recycle(self, pooled: Dict) -> None:
+        if pooled["uses"] < self.CONTEXT_MAX_USES:
+            self.idle.put_nowait(pooled)
+            return
+
+        self.size -= 1
+        try:
+            await pooled["context"].close()
+        except Exception as e:
+            Logger.warn("Failed to close browser context", str(e))
+        try:
+            await self._add_context()
+        except Exception:
+            # The pool refills on a later fetch
+            pass
+
+    async def close(self) -> None:
+        if self.browser is None:
+            return
+
+        await self.browser.close()
+        await self.playwright.stop()
+        self.browser = None
+        self.playwright = None
+        self.idle = None
+        self.size = 0
+        Logger.info("Browser pool closed")
@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from Logger import Logger
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+load_dotenv()
+
+SEGMENT_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+class CaptureArchive:
+    """
+    Append-only archive of raw fetched pages, for replaying real traffic through the parser.
+
+    Each response is written as its own compressed frame, a JSON header line followed by the body,
+    so segments can be appended to and read back at any record. Every segment has a JSON lines
+    index next to it with the offset, length and metadata of each record. A segment is closed and
+    a new one started once it reaches the size limit.
+    """
+    _instance = None
+    ENABLED = os.getenv('CAPTURE_ENABLED', 'false').lower() == 'true'
+    CAPTURE_DIR = os.getenv('CAPTURE_DIR', os.path.join(Logger.get_project_root(), 'captures'))
+    SEGMENT_MAX_BYTES = int(os.getenv('CAPTURE_SEGMENT_MAX_MB', 64)) * 1024 * 1024
+    COMPRESSION = os.getenv('CAPTURE_COMPRESSION', 'zstd' if zstandard is not None else 'gzip')
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(CaptureArchive, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        if self.COMPRESSION == 'zstd' and zstandard is None:
+            Logger.warn("zstandard is not installed, capturing with gzip instead")
+            self.COMPRESSION = 'gzip'
+        self.segment_path: Optional[str] = None
+        self.segment_file = None
+        self.index_file = None
+        self.segment_size = 0
+        self.segment_count = 0
+        self._compressor = zstandard.ZstdCompressor(level=3) if self.COMPRESSION == 'zstd' else None
+        # Records are written from worker threads
+        self._lock = threading.Lock()
+
+    def _compress(self, data: bytes) -> bytes:
+        if self._compressor is not None:
+            return self._compressor.compress(data)
+        return gzip.compress(data, compresslevel=5)
+
+    def _open_segment(self) -> None:
+        os.makedirs(self.CAPTURE_DIR, exist_ok=True)
+        self.segment_count += 1
+        name = f"capture-{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}-{os.getpid()}-{self.segment_count:04d}" \
+               f"{SEGMENT_EXTENSIONS[self.COMPRESSION]}"
+        self.segment_path = os.path.join(self.CAPTURE_DIR, name)
+        self.segment_file = open(self.segment_path, 'ab')
+        self.index_file = open(f"{self.segment_path}.idx", 'a', encoding='utf-8')
+        self.segment_size = self.segment_file.tell()
+        Logger.info(f"Capturing fetched pages to {self.segment_path}")
+
+    def _close_segment(self) -> None:
+        if self.segment_file is None:
+            return
+        self.segment_file.close()
+        self.index_file.close()
+        self.segment_file = None
+        self.index_file = None
+
+    def _write(self, meta: Dict, content: str) -> None:
+        body = content.encode('utf-8')
+        frame = self._compress(json.dumps(meta).encode('utf-8') + b'\n' + body)
+
+        with self._lock:
+            if self.segment_file is None or self.segment_size >= self.SEGMENT_MAX_BYTES:
+                self._close_segment()
+                self._open_segment()
+
+            offset = self.segment_size
+            self.segment_file.write(frame)
+            self.segment_file.flush()
+            self.segment_size += len(frame)
+            # The index line goes last so it never points at a partly written frame
+            self.index_file.write(json.dumps({**meta, "offset": offset, "length": len(frame), "size": len(body)}) + '\n')
+            self.index_file.flush()
+
+    async def record(self, url: str, status: int, content: str, elapsed_seconds: float, backend: str) -> None:
+        """Archive one response, a no-op unless CAPTURE_ENABLED=true"""
+        if not self.ENABLED:
+            return
+
+        meta = {
+            "url": url,
+            "status": status,
+            "elapsed_ms": round(elapsed_seconds * 1000, 1),
+            "backend": backend,
+            "captured_at": datetime.utcnow().isoformat()
+        }
+        try:
+            # Compressing a page takes a few milliseconds, keep it off the event loop
+            await asyncio.to_thread(self._write, meta, content)
+        except Exception as e:
+            Logger.error(f"Failed to capture response for {url}", e)
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_segment()
+
+
+def _decompress(path: str, frame: bytes) -> bytes:
+    if path.endswith(SEGMENT_EXTENSIONS['zstd']):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        return zstandard.ZstdDecompressor().decompress(frame)
+    return gzip.decompress(frame)
+
+
+def find_segments(paths: List[str]) -> List[str]:
+    """Expand directories into the segment files inside them, in capture order"""
+    segments = []
+    for path in paths:
+        if os.path.isdir(path):
+            for extension in SEGMENT_EXTENSIONS.values():
+                segments.extend(glob.glob(os.path.join(path, f"*{extension}")))
+        else:
+            segments.append(path)
+    return sorted(segments)
+
+
+def iter_records(segment_path: str) -> Iterator[Tuple[Dict, str]]:
+    """Yield (metadata, body) for every indexed record of a segment"""
+    with open(f"{segment_path}.idx", encoding='utf-8') as index, open(segment_path, 'rb') as segment:
+        for line in index:
+            entry = json.loads(line)
+            segment.seek(entry["offset"])
+            header, _, body = _decompress(segment_path, segment.read(entry["length"])).partition(b'\n')
+            yield json.loads(header), body.decode('utf-8')
+
+
+def iter_archive(paths: List[str], status: Optional[int] = None) -> Iterator[Tuple[Dict, str]]:
+    """Yield (metadata, body) for every record of the given segments, one at a time, optionally of one status"""
+    for segment_path in find_segments(paths):
+        for meta, body in iter_records(segment_path):
+            if status is None or meta["status"] == status:
+                yield meta, body
+
+
+def replay(paths: List[str], status: Optional[int] = 200) -> Dict:
+    """Run every archived page through the parser as fast as possible and report throughput"""
+    # Imported here so writing captures doesn't depend on the parser's imports
+    from utils import parse_product_page
+
+    # Records are streamed, only their timings are kept
+    parse_times = []
+    fetch_times = []
+    total_bytes = 0
+    failures: Dict[str, int] = {}
+    started_at = time.perf_counter()
+    for meta, body in iter_archive(paths, status):
+        parse_started_at = time.perf_counter()
+        try:
+            parse_product_page(body, meta["url"])
+        except Exception as e:
+            error = getattr(e, 'failure_class', type(e).__name__)
+            failures[error] = failures.get(error, 0) + 1
+        parse_times.append(time.perf_counter() - parse_started_at)
+        fetch_times.append(meta["elapsed_ms"])
+        total_bytes += len(body)
+    elapsed = time.perf_counter() - started_at
+    if not parse_times:
+        return {"records": 0}
+
+    # Throughput is of the parser alone, the wall time also covers reading and decompressing
+    parse_seconds = sum(parse_times)
+    parse_times.sort()
+    fetch_times.sort()
+    return {
+        "records": len(parse_times),
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(len(parse_times) / parse_seconds, 1),
+        "mb_per_second": round(total_bytes / parse_seconds / 1024 / 1024, 2),
+        "parse_p50_ms": round(parse_times[len(parse_times) // 2] * 1000, 2),
+        "parse_p99_ms": round(parse_times[min(int(len(parse_times) * 0.99), len(parse_times) - 1)] * 1000, 2),
+        "original_fetch_p50_ms": fetch_times[len(fetch_times) // 2]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured product pages through the parser")
+    parser.add_argument('paths', nargs='*', default=[CaptureArchive.CAPTURE_DIR],
+                        help="Segment files or directories of them")
+    parser.add_argument('--all-statuses', action='store_true', help="Also replay non-200 responses")
+    args = parser.parse_args()
+
+    Logger.info("Replay finished", replay(args.paths, status=None if args.all_statuses else 200))
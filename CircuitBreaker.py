@@ -0,0 +1,182 @@
+import os
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, Optional, Set
+
+from dotenv import load_dotenv
+
+from JobQueue import JobQueue
+from Logger import Logger
+
+load_dotenv()
+
+# Failure classes reported by fetch_product_data
+NETWORK = 'network'
+BANNED = 'banned'
+HTTP_5XX = 'http_5xx'
+HTTP_OTHER = 'http_other'
+LAYOUT = 'layout'
+PARSE = 'parse'
+# The page is fine but has no usable data for this product, e.g. it was delisted or the varSel is wrong
+PRODUCT = 'product'
+OTHER = 'other'
+
+# Failures that no proxy can fix, they mean the site itself changed or broke
+SITE_FAILURES = {LAYOUT, PARSE, HTTP_5XX}
+# Failures of a single product, they say nothing about the site and are not retried
+PRODUCT_FAILURES = {PRODUCT}
+
+
+class FetchError(Exception):
+    """A failed fetch attempt, tagged with the class of failure"""
+
+    def __init__(self, failure_class: str, message: str):
+        super().__init__(message)
+        self.failure_class = failure_class
+
+
+class CircuitOpenError(FetchError):
+    """Raised instead of fetching while the site circuit is open"""
+
+    def __init__(self, seconds_until_probe: float):
+        super().__init__(
+            'circuit_open',
+            f"The Perfume Shop appears to be down, checks are paused for {seconds_until_probe / 60:.0f} more minutes"
+        )
+        self.seconds_until_probe = seconds_until_probe
+
+
+class CircuitBreaker:
+    """
+    Site-level circuit breaker for product fetches.
+
+    Closed: every fetch goes through and attempt outcomes are tracked in a rolling window.
+    Open: fetches are refused until the cooldown passes, the cooldown doubles on every failed probe.
+    Half-open: a single canary fetch is let through, and its result closes or reopens the circuit.
+    """
+    _instance = None
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    WINDOW_SIZE = int(os.getenv('CIRCUIT_WINDOW_SIZE', 30))
+    MIN_SAMPLES = int(os.getenv('CIRCUIT_MIN_SAMPLES', 15))
+    FAILURE_RATE_THRESHOLD = float(os.getenv('CIRCUIT_FAILURE_RATE_THRESHOLD', 0.9))
+    # Consecutive site-level failures across this many distinct products, e.g. a layout change, trip the
+    # circuit without waiting for the window
+    SITE_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_SITE_FAILURE_THRESHOLD', 6))
+    COOLDOWN_SECONDS = int(os.getenv('CIRCUIT_COOLDOWN_SECONDS', 5 * 60))  # 5 minutes
+    MAX_COOLDOWN_SECONDS = int(os.getenv('CIRCUIT_MAX_COOLDOWN_SECONDS', 60 * 60))  # 1 hour
+    CANARY_WAIT_SECONDS = 5
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(CircuitBreaker, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        self.state = self.CLOSED
+        self.outcomes: Deque[Optional[str]] = deque(maxlen=self.WINDOW_SIZE)
+        # Products with a site-level failure since the last success
+        self.site_failure_urls: Set[str] = set()
+        self.cooldown_seconds = self.COOLDOWN_SECONDS
+        self.opened_at = 0.0
+        self.tripped_at = 0.0
+        self.canary_in_flight = False
+
+    def seconds_until_probe(self) -> float:
+        if self.state == self.CLOSED:
+            return 0.0
+        if self.canary_in_flight:
+            return self.CANARY_WAIT_SECONDS
+        return max(self.opened_at + self.cooldown_seconds - time.monotonic(), 0.0)
+
+    def is_open(self) -> bool:
+        """True if a fetch started now would be refused, without claiming the canary slot"""
+        return self.state != self.CLOSED and self.seconds_until_probe() > 0
+
+    def before_fetch(self) -> bool:
+        """Return True if a fetch may go ahead, in half-open state only the first caller becomes the canary"""
+        if self.state == self.CLOSED:
+            return True
+        if self.canary_in_flight or time.monotonic() < self.opened_at + self.cooldown_seconds:
+            return False
+
+        self.state = self.HALF_OPEN
+        self.canary_in_flight = True
+        Logger.info("Site circuit half-open, sending canary fetch")
+        return True
+
+    def record_success(self) -> None:
+        self.outcomes.append(None)
+        self.site_failure_urls.clear()
+
+    def record_failure(self, failure_class: str, url: str) -> None:
+        if self.state != self.CLOSED or failure_class in PRODUCT_FAILURES:
+            # Canary attempts are judged by after_fetch, and one bad product doesn't mean the site is down
+            return
+
+        self.outcomes.append(failure_class)
+        if failure_class in SITE_FAILURES:
+            # Retries of the same product count once
+            self.site_failure_urls.add(url)
+        else:
+            self.site_failure_urls.clear()
+
+        failures = [outcome for outcome in self.outcomes if outcome is not None]
+        failure_rate = len(failures) / len(self.outcomes)
+        if len(self.site_failure_urls) >= self.SITE_FAILURE_THRESHOLD or \
+                (len(self.outcomes) >= self.MIN_SAMPLES and failure_rate >= self.FAILURE_RATE_THRESHOLD):
+            self._open({
+                "failure_rate": round(failure_rate, 2),
+                "failure_classes": dict(Counter(failures)),
+                "products_with_site_failures": len(self.site_failure_urls)
+            })
+
+    def after_fetch(self, succeeded: bool) -> None:
+        """Settle a canary fetch once all its attempts are done"""
+        if self.state != self.HALF_OPEN or not self.canary_in_flight:
+            return
+
+        self.canary_in_flight = False
+        if succeeded:
+            self._close()
+        else:
+            self.cooldown_seconds = min(self.cooldown_seconds * 2, self.MAX_COOLDOWN_SECONDS)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            Logger.warn(f"Canary fetch failed, site circuit stays open for {self.cooldown_seconds}s")
+
+    def _open(self, details: Dict) -> None:
+        self.state = self.OPEN
+        self.opened_at = self.tripped_at = time.monotonic()
+        self.cooldown_seconds = self.COOLDOWN_SECONDS
+        details["cooldown_seconds"] = self.cooldown_seconds
+        Logger.critical("Site circuit opened, pausing product fetches", details)
+        self._notify(self.OPEN, details)
+
+    def _close(self) -> None:
+        downtime = round(time.monotonic() - self.tripped_at)
+        self.state = self.CLOSED
+        self.outcomes.clear()
+        self.site_failure_urls.clear()
+        self.cooldown_seconds = self.COOLDOWN_SECONDS
+        Logger.info("Site circuit closed after canary fetch succeeded")
+        self._notify(self.CLOSED, {"open_for_seconds": downtime})
+
+    @staticmethod
+    def _notify(state: str, details: Dict) -> None:
+        """Queue one admin alert per state change, workers in other processes dedupe on the same key"""
+        try:
+            JobQueue().enqueue(
+                JobQueue.ALERTS,
+                {"kind": "circuit", "state": state, "details": details},
+                dedupe_key=f"circuit:{state}"
+            )
+        except Exception as e:
+            Logger.error("Failed to queue circuit state alert", e)
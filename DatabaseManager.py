@@ -1,10 +1,13 @@
 import os
-from datetime import datetime
-from typing import Dict, List, Optional
+import threading
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Set
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, MongoClient, ReturnDocument, UpdateOne
 from pymongo.database import Database as MongoDatabase
-from pymongo.errors import DuplicateKeyError, PyMongoError
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 from Logger import Logger
 
 load_dotenv()
@@ -32,45 +35,68 @@ class DatabaseManager:
             raise ValueError("MongoDB URI not found in environment variables")
 
         self.client: Optional[MongoClient] = None
-        self.db: Optional[MongoDatabase] = None
+        self._db: Optional[MongoDatabase] = None
+        self._connect_lock = threading.Lock()
 
         # Collection names
         self.notification_channels_collection = 'notification_channels'
         self.watch_products_collection = 'watch_products'
         self.proxies_collection = 'proxies'
+        self.shard_leases_collection = 'shard_leases'
+        self.bot_state_collection = 'bot_state'
+        self.proxy_sessions_collection = 'proxy_sessions'
 
-        # Connect to database
-        self._connect()
+    @property
+    def db(self) -> MongoDatabase:
+        """Connect and create indexes on first use instead of at import time"""
+        if self._db is None:
+            with self._connect_lock:
+                if self._db is None:
+                    db = self._connect()
+                    self._create_indexes(db)
+                    self._db = db
+        return self._db
 
-        # Create indexes
-        self._create_indexes()
-
-    def _connect(self) -> None:
+    def _connect(self) -> MongoDatabase:
         """Establish connection to MongoDB"""
         try:
             Logger.info("Connecting to MongoDB...")
             self.client = MongoClient(self.mongo_uri)
-            self.db = self.client[self.db_name]
             Logger.info("Successfully connected to MongoDB")
+            return self.client[self.db_name]
         except PyMongoError as e:
             Logger.critical("Failed to connect to MongoDB", e)
             raise
 
-    def _create_indexes(self) -> None:
+    def _create_indexes(self, db: MongoDatabase) -> None:
         """Create necessary indexes for collections"""
         try:
             # Create unique index for channel_id
-            self.db[self.notification_channels_collection].create_index(
+            db[self.notification_channels_collection].create_index(
                 "channel_id", unique=True
             )
             # Create unique index for product_url
-            self.db[self.watch_products_collection].create_index(
+            db[self.watch_products_collection].create_index(
                 "product_url", unique=True
             )
             # Create unique index for proxy http URL
-            self.db[self.proxies_collection].create_index(
+            db[self.proxies_collection].create_index(
                 "http", unique=True
             )
+            # Index shard key so sweep workers can select their shard
+            db[self.watch_products_collection].create_index("shard_key")
+            # Create unique index for shard number
+            db[self.shard_leases_collection].create_index(
+                "shard", unique=True
+            )
+            # Create unique index for proxy session http URL
+            db[self.proxy_sessions_collection].create_index(
+                "http", unique=True
+            )
+            # Create unique index for bot state key
+            db[self.bot_state_collection].create_index(
+                "key", unique=True
+            )
             Logger.info("Database indexes created successfully")
         except PyMongoError as e:
             Logger.error("Failed to create indexes", e)
@@ -122,6 +148,7 @@ class DatabaseManager:
         try:
             result = self.db[self.watch_products_collection].insert_one({
                 "product_url": product_url,
+                "shard_key": self.get_shard_key(product_url),
                 "created_at": datetime.utcnow(),
                 "updated_at": datetime.utcnow()
             })
@@ -134,6 +161,37 @@ class DatabaseManager:
             Logger.error(f"Failed to add product URL: {product_url}", e)
             raise
 
+    def add_watch_products(self, product_urls: List[str]) -> Set[str]:
+        """
+        Add many product URLs in a single unordered bulk insert
+        Returns the URLs that were inserted, URLs that already exist are skipped
+        """
+        if not product_urls:
+            return set()
+
+        documents = [{
+            "product_url": product_url,
+            "shard_key": self.get_shard_key(product_url),
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        } for product_url in product_urls]
+
+        try:
+            self.db[self.watch_products_collection].insert_many(documents, ordered=False)
+            inserted = set(product_urls)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            if any(error.get('code') != 11000 for error in write_errors):
+                Logger.error("Failed to bulk add product URLs", write_errors)
+                raise
+            inserted = set(product_urls) - {product_urls[error['index']] for error in write_errors}
+        except PyMongoError as e:
+            Logger.error("Failed to bulk add product URLs", e)
+            raise
+
+        Logger.info(f"Bulk added {len(inserted)} of {len(product_urls)} watch products")
+        return inserted
+
     def remove_watch_product(self, product_url: str) -> bool:
         """
         Remove a product URL from watch_products collection
@@ -161,6 +219,156 @@ class DatabaseManager:
             Logger.error("Failed to fetch watch products", e)
             raise
 
+    def iter_watch_products(self, batch_size: int = 1000) -> Iterator[str]:
+        """Stream all product URLs in _id order without holding the whole collection in memory"""
+        try:
+            cursor = self.db[self.watch_products_collection].find(
+                {}, {"product_url": 1, "_id": 0}
+            ).sort("_id", ASCENDING).batch_size(batch_size)
+            for product in cursor:
+                yield product["product_url"]
+        except PyMongoError as e:
+            Logger.error("Failed to stream watch products", e)
+            raise
+
+    def get_watch_products_page(self, limit: int, after_id: Optional[ObjectId] = None,
+                                before_id: Optional[ObjectId] = None) -> List[Dict]:
+        """
+        Return up to `limit` watched products ordered by _id, starting after `after_id` or ending before `before_id`
+        Uses a range on _id instead of skip so every page costs the same regardless of its position
+        """
+        try:
+            projection = {"product_url": 1, "created_at": 1}
+            collection = self.db[self.watch_products_collection]
+            if before_id is not None:
+                cursor = collection.find({"_id": {"$lt": before_id}}, projection).sort("_id", DESCENDING)
+                return list(cursor.limit(limit))[::-1]
+
+            query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+            return list(collection.find(query, projection).sort("_id", ASCENDING).limit(limit))
+        except PyMongoError as e:
+            Logger.error("Failed to fetch watch products page", e)
+            raise
+
+    def count_watch_products(self) -> int:
+        """Return the approximate number of watched products from collection metadata"""
+        try:
+            return self.db[self.watch_products_collection].estimated_document_count()
+        except PyMongoError as e:
+            Logger.error("Failed to count watch products", e)
+            raise
+
+    @staticmethod
+    def get_shard_key(product_url: str) -> int:
+        """Stable hash of a product URL used to assign it to a sweep shard"""
+        return zlib.crc32(product_url.encode('utf-8'))
+
+    def backfill_shard_keys(self) -> int:
+        """Set shard_key on watched products added before sharding existed"""
+        try:
+            collection = self.db[self.watch_products_collection]
+            updated = 0
+            for product in collection.find({"shard_key": {"$exists": False}}, {"product_url": 1}):
+                collection.update_one(
+                    {"_id": product["_id"]},
+                    {"$set": {"shard_key": self.get_shard_key(product["product_url"])}}
+                )
+                updated += 1
+            if updated:
+                Logger.info(f"Backfilled shard keys for {updated} watch products")
+            return updated
+        except PyMongoError as e:
+            Logger.error("Failed to backfill shard keys", e)
+            raise
+
+    def get_watch_products_for_shard(self, shard: int, shard_count: int) -> List[str]:
+        """Return product URLs whose shard key falls into the given shard"""
+        try:
+            products = self.db[self.watch_products_collection].find(
+                {"shard_key": {"$mod": [shard_count, shard]}},
+                {"product_url": 1, "_id": 0}
+            )
+            return [product["product_url"] for product in products]
+        except PyMongoError as e:
+            Logger.error(f"Failed to fetch watch products for shard {shard}/{shard_count}", e)
+            raise
+
+    def claim_shard_lease(self, worker_id: str, shard_count: int, lease_seconds: int) -> Optional[int]:
+        """
+        Claim the first shard whose lease has expired and whose next sweep is due
+        Returns the shard number, or None if every shard is leased or not yet due
+        """
+        now = datetime.utcnow()
+        collection = self.db[self.shard_leases_collection]
+        for shard in range(shard_count):
+            try:
+                lease = collection.find_one_and_update(
+                    {
+                        "shard": shard,
+                        "expires_at": {"$lte": now},
+                        "next_sweep_at": {"$lte": now}
+                    },
+                    {
+                        "$set": {
+                            "owner": worker_id,
+                            "expires_at": now + timedelta(seconds=lease_seconds),
+                            "updated_at": now
+                        },
+                        "$setOnInsert": {
+                            "next_sweep_at": now,
+                            "created_at": now
+                        }
+                    },
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+                if lease:
+                    Logger.info(f"Worker {worker_id} claimed shard {shard}/{shard_count}")
+                    return shard
+            except DuplicateKeyError:
+                # Lease exists and is held by another worker or not due yet
+                continue
+            except PyMongoError as e:
+                Logger.error(f"Failed to claim shard lease {shard}", e)
+                raise
+        return None
+
+    def renew_shard_lease(self, shard: int, worker_id: str, lease_seconds: int) -> bool:
+        """
+        Extend a held shard lease
+        Returns False if the lease was lost to another worker
+        """
+        try:
+            result = self.db[self.shard_leases_collection].update_one(
+                {"shard": shard, "owner": worker_id},
+                {"$set": {
+                    "expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds),
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            return result.matched_count > 0
+        except PyMongoError as e:
+            Logger.error(f"Failed to renew shard lease {shard}", e)
+            raise
+
+    def release_shard_lease(self, shard: int, worker_id: str, next_sweep_at: datetime) -> None:
+        """Release a held shard lease and schedule the shard's next sweep"""
+        try:
+            self.db[self.shard_leases_collection].update_one(
+                {"shard": shard, "owner": worker_id},
+                {"$set": {
+                    "owner": None,
+                    "expires_at": datetime.utcnow(),
+                    "next_sweep_at": next_sweep_at,
+                    "last_swept_by": worker_id,
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            Logger.info(f"Worker {worker_id} released shard {shard}")
+        except PyMongoError as e:
+            Logger.error(f"Failed to release shard lease {shard}", e)
+            raise
+
     def get_all_notification_channels(self) -> List[str]:
         """Return all channel IDs from notification_channels collection"""
         try:
@@ -197,6 +405,7 @@ class DatabaseManager:
                     "asn_name": proxy_data.get('asn_name'),
                     "asn_number": proxy_data.get('asn_number'),
                     "high_country_confidence": proxy_data.get('high_country_confidence'),
+                    "rtt_ms": proxy_data.get('rtt_ms'),
                     "http": proxy_data['http']
                 }
             }
@@ -208,11 +417,58 @@ class DatabaseManager:
                 upsert=True
             )
 
-            Logger.info(f"Successfully {'updated' if result.matched_count else 'added'} proxy: {proxy_data['http']}")
+            Logger.info(f"Successfully {'updated' if result.matched_count else 'added'} proxy: {proxy_data.get('proxy_address')}")
             return True
 
         except PyMongoError as e:
-            Logger.error(f"Failed to add/update proxy: {proxy_data.get('http')}", e)
+            Logger.error(f"Failed to add/update proxy: {proxy_data.get('proxy_address')}", e)
+            raise
+
+    def get_proxy_sessions(self) -> List[Dict]:
+        """Return all stored proxy sessions"""
+        try:
+            return list(self.db[self.proxy_sessions_collection].find({}, {"_id": 0}))
+        except PyMongoError as e:
+            Logger.error("Failed to fetch proxy sessions", e)
+            raise
+
+    def save_proxy_sessions(self, sessions: List[Dict]) -> None:
+        """Upsert proxy sessions in a single bulk write"""
+        if not sessions:
+            return
+
+        try:
+            self.db[self.proxy_sessions_collection].bulk_write([
+                UpdateOne(
+                    {"http": session["http"]},
+                    {"$set": {**session, "updated_at": datetime.utcnow()}},
+                    upsert=True
+                )
+                for session in sessions
+            ], ordered=False)
+        except PyMongoError as e:
+            Logger.error(f"Failed to save {len(sessions)} proxy sessions", e)
+            raise
+
+    def get_bot_state(self, key: str) -> Optional[str]:
+        """Return a value stored in the bot_state collection"""
+        try:
+            state = self.db[self.bot_state_collection].find_one({"key": key}, {"value": 1, "_id": 0})
+            return state["value"] if state else None
+        except PyMongoError as e:
+            Logger.error(f"Failed to read bot state: {key}", e)
+            raise
+
+    def set_bot_state(self, key: str, value: str) -> None:
+        """Store a value in the bot_state collection"""
+        try:
+            self.db[self.bot_state_collection].update_one(
+                {"key": key},
+                {"$set": {"value": value, "updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except PyMongoError as e:
+            Logger.error(f"Failed to write bot state: {key}", e)
             raise
 
     def close(self):
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from Logger import Logger
+
+load_dotenv()
+
+
+class FetchExecutor:
+    """
+    Prioritized concurrency limit for product fetches.
+
+    Fetches run in one of three lanes, highest priority first: interactive (slash commands),
+    scheduled (the sweep) and bulk (imports). A number of slots is reserved for interactive
+    fetches, so a user's check never queues behind a full sweep. A background fetch that has
+    waited longer than the starvation limit jumps ahead of newer, higher priority ones.
+    """
+    _instance = None
+    INTERACTIVE = 'interactive'
+    SCHEDULED = 'scheduled'
+    BULK = 'bulk'
+    LANES = (INTERACTIVE, SCHEDULED, BULK)
+
+    MAX_CONCURRENCY = int(os.getenv('FETCH_MAX_CONCURRENCY', 10))
+    RESERVED_INTERACTIVE_SLOTS = int(os.getenv('FETCH_RESERVED_INTERACTIVE_SLOTS', 2))
+    STARVATION_SECONDS = int(os.getenv('FETCH_STARVATION_SECONDS', 30))
+    MAX_SAMPLES = 1000
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(FetchExecutor, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        self.active: Dict[str, int] = {lane: 0 for lane in self.LANES}
+        self.waiters: Dict[str, Deque[Tuple[float, asyncio.Future]]] = {lane: deque() for lane in self.LANES}
+        # (time spent queued, total time including the fetch) per completed fetch
+        self.samples: Dict[str, Deque[Tuple[float, float]]] = {
+            lane: deque(maxlen=self.MAX_SAMPLES) for lane in self.LANES
+        }
+        self.promotions: Dict[str, int] = {lane: 0 for lane in self.LANES}
+
+    def _has_capacity(self, lane: str) -> bool:
+        in_flight = sum(self.active.values())
+        if lane == self.INTERACTIVE:
+            return in_flight < self.MAX_CONCURRENCY
+        background_slots = max(self.MAX_CONCURRENCY - self.RESERVED_INTERACTIVE_SLOTS, 1)
+        return in_flight < self.MAX_CONCURRENCY and \
+            self.active[self.SCHEDULED] + self.active[self.BULK] < background_slots
+
+    def _next_lane(self) -> Optional[str]:
+        """Pick the lane whose oldest waiter runs next, starving waiters first"""
+        now = time.perf_counter()
+        starving = [
+            (self.waiters[lane][0][0], lane) for lane in self.LANES
+            if self.waiters[lane] and now - self.waiters[lane][0][0] >= self.STARVATION_SECONDS
+            and self._has_capacity(lane)
+        ]
+        if starving:
+            lane = min(starving)[1]
+            if lane != self.INTERACTIVE:
+                self.promotions[lane] += 1
+            return lane
+
+        for lane in self.LANES:
+            if self.waiters[lane] and self._has_capacity(lane):
+                return lane
+        return None
+
+    def _dispatch(self) -> None:
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            _, future = self.waiters[lane].popleft()
+            if future.done():
+                continue
+            self.active[lane] += 1
+            future.set_result(None)
+
+    async def _acquire(self, lane: str) -> None:
+        future = asyncio.get_running_loop().create_future()
+        entry = (time.perf_counter(), future)
+        self.waiters[lane].append(entry)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as we were cancelled, hand it on
+                self._release(lane)
+            elif entry in self.waiters[lane]:
+                self.waiters[lane].remove(entry)
+            raise
+
+    def _release(self, lane: str) -> None:
+        self.active[lane] -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane: str):
+        """Hold one fetch slot in `lane` for the enclosed block"""
+        if lane not in self.LANES:
+            raise ValueError(f"Unknown fetch lane: {lane}")
+
+        queued_at = time.perf_counter()
+        await self._acquire(lane)
+        started_at = time.perf_counter()
+        if started_at - queued_at > 1:
+            Logger.debug(f"Fetch in {lane} lane waited {started_at - queued_at:.1f}s for a slot")
+        try:
+            yield
+        finally:
+            self._release(lane)
+            self.samples[lane].append((started_at - queued_at, time.perf_counter() - queued_at))
+
+    @staticmethod
+    def _percentile(values: List[float], p: float) -> Optional[float]:
+        if not values:
+            return None
+        return round(values[min(int(len(values) * p), len(values) - 1)] * 1000, 1)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """Per-lane queue and latency percentiles in milliseconds over recent fetches"""
+        percentile = self._percentile
+        stats = {}
+        for lane in self.LANES:
+            samples = list(self.samples[lane])
+            waits = sorted(sample[0] for sample in samples)
+            totals = sorted(sample[1] for sample in samples)
+            stats[lane] = {
+                "in_flight": self.active[lane],
+                "waiting": len(self.waiters[lane]),
+                "completed": len(samples),
+                "wait_p50_ms": percentile(waits, 0.50),
+                "wait_p99_ms": percentile(waits, 0.99),
+                "latency_p50_ms": percentile(totals, 0.50),
+                "latency_p90_ms": percentile(totals, 0.90),
+                "latency_p99_ms": percentile(totals, 0.99),
+                "promotions": self.promotions[lane]
+            }
+        return stats
@@ -0,0 +1,304 @@
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+
+from DatabaseManager import DatabaseManager
+from Logger import Logger
+
+
+class JobQueue:
+    """
+    Durable job queue stored in MongoDB.
+
+    Claimed jobs stay invisible for a visibility timeout and are handed out again if they are not
+    acknowledged in time, so a crashed worker never loses a job. Jobs may carry a dedupe key which
+    is unique across all queued jobs.
+    """
+    _instance = None
+    DEFAULT_VISIBILITY_TIMEOUT = 5 * 60  # 5 minutes
+    MAX_ATTEMPTS = 10
+
+    CHECKS = 'checks'
+    NOTIFICATIONS = 'notifications'
+    ALERTS = 'alerts'
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(JobQueue, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        self.jobs_collection = 'jobs'
+        self.db = DatabaseManager().db
+        self._create_indexes()
+        self._retire_dead_dedupe_keys()
+
+    def _create_indexes(self) -> None:
+        """Create necessary indexes for the jobs collection"""
+        try:
+            # Claims look up visible jobs of a queue in visibility order
+            self.db[self.jobs_collection].create_index(
+                [("queue", ASCENDING), ("visible_at", ASCENDING)]
+            )
+            # Create unique index for dedupe keys, ignoring jobs without one
+            self.db[self.jobs_collection].create_index(
+                "dedupe_key",
+                unique=True,
+                partialFilterExpression={"dedupe_key": {"$type": "string"}}
+            )
+            # Claim tokens are used to read back a claimed batch
+            self.db[self.jobs_collection].create_index("claim_token")
+        except PyMongoError as e:
+            Logger.error("Failed to create job queue indexes", e)
+            raise
+
+    @staticmethod
+    def _dead_dedupe_key(job: Dict) -> str:
+        return f"dead:{job['dedupe_key']}:{job['_id']}"
+
+    def _retire_dead_dedupe_keys(self) -> None:
+        """Free the dedupe keys of jobs parked as dead before their keys were renamed on release"""
+        try:
+            collection = self.db[self.jobs_collection]
+            for job in collection.find(
+                {"status": "dead", "dedupe_key": {"$type": "string", "$not": {"$regex": "^dead:"}}},
+                {"_id": 1, "dedupe_key": 1}
+            ):
+                collection.update_one({"_id": job["_id"]}, {"$set": {"dedupe_key": self._dead_dedupe_key(job)}})
+        except PyMongoError as e:
+            Logger.error("Failed to retire dedupe keys of dead jobs", e)
+            raise
+
+    @staticmethod
+    def _new_job(queue: str, payload: Dict, dedupe_key: Optional[str], shard: Optional[int]) -> Dict:
+        now = datetime.utcnow()
+        job = {
+            "queue": queue,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "visible_at": now,
+            "created_at": now,
+            "updated_at": now
+        }
+        if dedupe_key is not None:
+            job["dedupe_key"] = dedupe_key
+        if shard is not None:
+            job["shard"] = shard
+        return job
+
+    def enqueue(self, queue: str, payload: Dict, dedupe_key: Optional[str] = None,
+                shard: Optional[int] = None) -> bool:
+        """
+        Add a job to a queue
+        Returns True if queued, False if a job with the same dedupe key is already queued
+        """
+        try:
+            self.db[self.jobs_collection].insert_one(self._new_job(queue, payload, dedupe_key, shard))
+            return True
+        except DuplicateKeyError:
+            Logger.debug(f"Job already queued: {dedupe_key}")
+            return False
+        except PyMongoError as e:
+            Logger.error(f"Failed to enqueue job on {queue}: {dedupe_key}", e)
+            raise
+
+    def enqueue_many(self, queue: str, jobs: List[Dict], shard: Optional[int] = None) -> int:
+        """
+        Add many jobs to a queue in one round trip, each given as {"payload": ..., "dedupe_key": ...}
+        Returns the number of jobs queued, skipping duplicates
+        """
+        if not jobs:
+            return 0
+
+        documents = [self._new_job(queue, job["payload"], job.get("dedupe_key"), shard) for job in jobs]
+        try:
+            result = self.db[self.jobs_collection].insert_many(documents, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as e:
+            non_duplicate_errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != 11000]
+            if non_duplicate_errors:
+                Logger.error(f"Failed to enqueue jobs on {queue}", non_duplicate_errors)
+                raise
+            return e.details.get('nInserted', 0)
+        except PyMongoError as e:
+            Logger.error(f"Failed to enqueue jobs on {queue}", e)
+            raise
+
+    def claim(self, queue: str, worker_id: str, batch_size: int = 10,
+              visibility_timeout: int = DEFAULT_VISIBILITY_TIMEOUT, shard: Optional[int] = None) -> List[Dict]:
+        """
+        Claim up to `batch_size` visible jobs from a queue
+        Jobs that are not acked within `visibility_timeout` seconds become visible again
+        """
+        now = datetime.utcnow()
+        query = {
+            "queue": queue,
+            "status": {"$in": ["pending", "claimed"]},
+            "visible_at": {"$lte": now}
+        }
+        if shard is not None:
+            query["shard"] = shard
+
+        try:
+            collection = self.db[self.jobs_collection]
+            candidate_ids = [
+                job["_id"] for job in
+                collection.find(query, {"_id": 1}).sort("visible_at", ASCENDING).limit(batch_size)
+            ]
+            if not candidate_ids:
+                return []
+
+            # Re-check visibility in the update so jobs claimed concurrently by another worker are skipped
+            claim_token = uuid.uuid4().hex
+            collection.update_many(
+                {**query, "_id": {"$in": candidate_ids}},
+                {
+                    "$set": {
+                        "status": "claimed",
+                        "claimed_by": worker_id,
+                        "claim_token": claim_token,
+                        "visible_at": now + timedelta(seconds=visibility_timeout),
+                        "updated_at": now
+                    },
+                    "$inc": {"attempts": 1}
+                }
+            )
+            jobs = list(collection.find({"claim_token": claim_token}).sort("created_at", ASCENDING))
+            if jobs:
+                Logger.debug(f"Worker {worker_id} claimed {len(jobs)} jobs from {queue}")
+            return jobs
+        except PyMongoError as e:
+            Logger.error(f"Failed to claim jobs from {queue}", e)
+            raise
+
+    def ack(self, job: Dict) -> bool:
+        """
+        Remove a finished job
+        Returns False if the claim had expired and the job was handed to another worker
+        """
+        try:
+            result = self.db[self.jobs_collection].delete_one({
+                "_id": job["_id"],
+                "claim_token": job["claim_token"]
+            })
+            if result.deleted_count == 0:
+                Logger.warn(f"Job claim expired before ack: {job.get('dedupe_key') or job['_id']}")
+                return False
+            return True
+        except PyMongoError as e:
+            Logger.error(f"Failed to ack job: {job['_id']}", e)
+            raise
+
+    def release(self, job: Dict, delay_seconds: int = 0, count_attempt: bool = True) -> None:
+        """
+        Return a claimed job to its queue for a retry, or park it once it runs out of attempts
+        Jobs put back unattempted, e.g. while the site is down, pass `count_attempt=False`
+        A dead job gives up its dedupe key so the same work can be queued again
+        """
+        status = "dead" if count_attempt and job.get("attempts", 0) >= self.MAX_ATTEMPTS else "pending"
+        update = {"$set": {
+            "status": status,
+            "claim_token": None,
+            "visible_at": datetime.utcnow() + timedelta(seconds=delay_seconds),
+            "updated_at": datetime.utcnow()
+        }}
+        if not count_attempt:
+            update["$inc"] = {"attempts": -1}
+        if status == "dead" and job.get("dedupe_key") is not None:
+            update["$set"]["dedupe_key"] = self._dead_dedupe_key(job)
+        try:
+            self.db[self.jobs_collection].update_one(
+                {"_id": job["_id"], "claim_token": job["claim_token"]},
+                update
+            )
+            if status == "dead":
+                Logger.error(f"Job exceeded {self.MAX_ATTEMPTS} attempts: {job.get('dedupe_key') or job['_id']}")
+        except PyMongoError as e:
+            Logger.error(f"Failed to release job: {job['_id']}", e)
+            raise
+
+    def extend(self, job: Dict, visibility_timeout: int = DEFAULT_VISIBILITY_TIMEOUT) -> bool:
+        """
+        Keep a long-running job claimed for another `visibility_timeout` seconds
+        Returns False if the claim had already expired
+        """
+        try:
+            result = self.db[self.jobs_collection].update_one(
+                {"_id": job["_id"], "claim_token": job["claim_token"]},
+                {"$set": {
+                    "visible_at": datetime.utcnow() + timedelta(seconds=visibility_timeout),
+                    "updated_at": datetime.utcnow()
+                }}
+            )
+            return result.matched_count > 0
+        except PyMongoError as e:
+            Logger.error(f"Failed to extend job: {job['_id']}", e)
+            raise
+
+    def transfer(self, job: Dict, queue: str, payload: Dict, dedupe_key: Optional[str] = None) -> bool:
+        """
+        Atomically turn a claimed job into a new pending job on another queue
+        Used to hand a finished check over to the notification queue without a window where both or neither exist
+        """
+        update = {
+            "$set": {
+                "queue": queue,
+                "payload": payload,
+                "status": "pending",
+                "attempts": 0,
+                "claim_token": None,
+                "claimed_by": None,
+                "visible_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow()
+            }
+        }
+        if dedupe_key is not None:
+            update["$set"]["dedupe_key"] = dedupe_key
+        else:
+            update["$unset"] = {"dedupe_key": ""}
+
+        try:
+            result = self.db[self.jobs_collection].update_one(
+                {"_id": job["_id"], "claim_token": job["claim_token"]},
+                update
+            )
+            if result.matched_count == 0:
+                Logger.warn(f"Job claim expired before transfer: {job.get('dedupe_key') or job['_id']}")
+                return False
+            return True
+        except DuplicateKeyError:
+            # An equivalent job is already queued, so this one is redundant
+            Logger.warn(f"Job already queued on {queue}: {dedupe_key}")
+            self.ack(job)
+            return False
+        except PyMongoError as e:
+            Logger.error(f"Failed to transfer job {job['_id']} to {queue}", e)
+            raise
+
+    def add_to_payload_set(self, job: Dict, field: str, value) -> bool:
+        """
+        Record progress on a claimed job so a retry can skip work that is already done
+        Returns False if the claim had expired and the job was handed to another worker
+        """
+        try:
+            result = self.db[self.jobs_collection].update_one(
+                {"_id": job["_id"], "claim_token": job["claim_token"]},
+                {"$addToSet": {f"payload.{field}": value}, "$set": {"updated_at": datetime.utcnow()}}
+            )
+            job["payload"].setdefault(field, []).append(value)
+            if result.matched_count == 0:
+                Logger.warn(f"Job claim expired before progress update: {job.get('dedupe_key') or job['_id']}")
+                return False
+            return True
+        except PyMongoError as e:
+            Logger.error(f"Failed to update job progress: {job['_id']}", e)
+            raise
@@ -1,12 +1,55 @@
 import json
 import logging
-import inspect
 import os
+import random
+import re
+import sys
+import threading
+import time
 import traceback
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 from colorama import Fore, init
+from dotenv import load_dotenv
 
 init(autoreset=True)
+load_dotenv()
+
+
+# Invalid logging settings, reported once the Logger exists
+_settings_warnings: List[str] = []
+
+
+def _parse_level(setting: str, default: str) -> int:
+    """Read a level name from the environment once, falling back to the default if it isn't a level"""
+    value = os.getenv(setting, default)
+    level = logging.getLevelName(value.strip().upper())
+    if not isinstance(level, int):
+        _settings_warnings.append(f"Invalid {setting} '{value}', using {default}")
+        return logging.getLevelName(default)
+    return level
+
+
+def _parse_sample_rates(value: str) -> Dict[int, float]:
+    """Parse 'debug=0.1,info=0.5' into {logging.DEBUG: 0.1, logging.INFO: 0.5}"""
+    rates = {}
+    for item in value.split(','):
+        if '=' in item:
+            level_name, rate = item.split('=', 1)
+            level = logging.getLevelName(level_name.strip().upper())
+            try:
+                rate = float(rate)
+            except ValueError:
+                rate = None
+            if not isinstance(level, int) or rate is None:
+                _settings_warnings.append(f"Ignoring invalid LOG_SAMPLE_RATES entry '{item.strip()}'")
+                continue
+            rates[level] = rate
+    return rates
+
+
+# URLs and numbers vary between otherwise identical lines, e.g. one error per product
+_DEDUPE_NORMALIZERS = [(re.compile(r'https?://\S+'), '<url>'), (re.compile(r'\d+'), '#')]
 
 
 class Logger:
@@ -16,6 +59,13 @@ class Logger:
     LOG_LEVEL_PADDING = 10
     FILE_PATH_PADDING = 30
 
+    # Storm suppression: similar lines at or above this level are rate limited per key
+    DEDUPE_MIN_LEVEL = _parse_level('LOG_DEDUPE_MIN_LEVEL', 'WARNING')
+    RATE_LIMIT_BURST = int(os.getenv('LOG_RATE_LIMIT_BURST', 5))
+    RATE_LIMIT_WINDOW_SECONDS = int(os.getenv('LOG_RATE_LIMIT_WINDOW_SECONDS', 60))
+    # Fraction of lines kept per level, e.g. LOG_SAMPLE_RATES=debug=0.1,info=0.5
+    SAMPLE_RATES = _parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', ''))
+
     COLORS = {
         'timestamp': Fore.WHITE,
         'debug': Fore.CYAN,
@@ -30,6 +80,12 @@ class Logger:
     __console_logger = None
     __file_logger = None
 
+    # Dedupe key -> [window started at, lines emitted, lines suppressed, level, message, file path info]
+    __rate_limits: Dict[Tuple, List] = {}
+    __last_summary_check = 0.0
+    # Threads such as the loop watchdog log too
+    __lock = threading.Lock()
+
     @staticmethod
     def __setup_loggers():
         if Logger.__console_logger is None:
@@ -65,9 +121,10 @@ class Logger:
 
     @staticmethod
     def __get_log_details():
-        frame = inspect.stack()[3]
-        file_name = frame.filename
-        line_number = frame.lineno
+        # Only the caller's frame is needed, inspect.stack() would build context for every frame
+        frame = sys._getframe(3)
+        file_name = frame.f_code.co_filename
+        line_number = frame.f_lineno
 
         project_root = Logger.get_project_root()
         relative_file_name = os.path.relpath(file_name, project_root)
@@ -77,10 +134,88 @@ class Logger:
         file_path_info = f"{relative_file_name}:{line_number}"
         return timestamp, file_path_info
 
+    @staticmethod
+    def __dedupe_key(level, message, details) -> Tuple:
+        for pattern, replacement in _DEDUPE_NORMALIZERS:
+            message = pattern.sub(replacement, message)
+        return level, message, type(details).__name__ if isinstance(details, Exception) else None
+
+    @staticmethod
+    def __expired_summaries(now: float) -> List[Tuple[int, str, str]]:
+        """Close rate limit windows that have ended, returning a summary for each that suppressed lines"""
+        summaries = []
+        for key, entry in list(Logger.__rate_limits.items()):
+            if now - entry[0] < Logger.RATE_LIMIT_WINDOW_SECONDS:
+                continue
+            del Logger.__rate_limits[key]
+            if entry[2]:
+                summaries.append(Logger.__summary(entry))
+        return summaries
+
+    @staticmethod
+    def __summary(entry: List) -> Tuple[int, str, str]:
+        _, _, suppressed, level, message, file_path_info = entry
+        return level, f"Suppressed {suppressed} similar lines in the last {Logger.RATE_LIMIT_WINDOW_SECONDS}s: {message}", \
+            file_path_info
+
+    @staticmethod
+    def __allow(level, message, details) -> Tuple[bool, List[Tuple[int, str, str]], Optional[List]]:
+        """
+        Decide whether a line is emitted before paying for formatting it
+        Returns the decision, summaries of windows that just ended, and the rate limit entry to fill in
+        """
+        now = time.monotonic()
+        summaries = []
+        if now - Logger.__last_summary_check >= 1:
+            with Logger.__lock:
+                Logger.__last_summary_check = now
+                summaries = Logger.__expired_summaries(now)
+
+        sample_rate = Logger.SAMPLE_RATES.get(level, 1.0)
+        if sample_rate < 1.0 and random.random() >= sample_rate:
+            return False, summaries, None
+        if level < Logger.DEDUPE_MIN_LEVEL:
+            return True, summaries, None
+
+        key = Logger.__dedupe_key(level, message, details)
+        with Logger.__lock:
+            entry = Logger.__rate_limits.get(key)
+            if entry is None or now - entry[0] >= Logger.RATE_LIMIT_WINDOW_SECONDS:
+                if entry is not None and entry[2]:
+                    summaries.append(Logger.__summary(entry))
+                entry = [now, 0, 0, level, message, None]
+                Logger.__rate_limits[key] = entry
+            if entry[1] >= Logger.RATE_LIMIT_BURST:
+                entry[2] += 1
+                return False, summaries, None
+            entry[1] += 1
+            return True, summaries, entry
+
+    @staticmethod
+    def flush_suppressed():
+        """Emit summaries for every window with suppressed lines, e.g. on shutdown"""
+        with Logger.__lock:
+            summaries = Logger.__expired_summaries(float('inf'))
+        for level, summary, file_path_info in summaries:
+            Logger.__write(level, summary, None, False, datetime.utcnow().isoformat(), file_path_info)
+
     @staticmethod
     def __log(level, message, details, no_meta=False):
-        Logger.__setup_loggers()
+        emit, summaries, entry = Logger.__allow(level, message, details)
+        if summaries or emit:
+            Logger.__setup_loggers()
+        for summary_level, summary, file_path_info in summaries:
+            Logger.__write(summary_level, summary, None, False, datetime.utcnow().isoformat(), file_path_info)
+        if not emit:
+            return
+
         timestamp, file_path_info = Logger.__get_log_details()
+        if entry is not None and entry[5] is None:
+            entry[5] = file_path_info
+        Logger.__write(level, message, details, no_meta, timestamp, file_path_info)
+
+    @staticmethod
+    def __write(level, message, details, no_meta, timestamp, file_path_info):
         level_name = logging.getLevelName(level).lower()
 
         if no_meta:
@@ -129,3 +264,7 @@ class Logger:
     @staticmethod
     def critical(message, details=None, no_meta=False):
         Logger.__log(logging.CRITICAL, message, details, no_meta)
+
+
+for _warning in _settings_warnings:
+    Logger.warn(_warning)
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from Logger import Logger
+
+load_dotenv()
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag and captures the stack of code that blocks the loop.
+
+    A coroutine ticks every interval and records how late it woke up. A separate thread watches
+    the tick, and when it goes stale for longer than the threshold it grabs the loop thread's
+    current stack, which is the code that is blocking.
+    """
+    _instance = None
+    ENABLED = os.getenv('LOOP_WATCHDOG_ENABLED', 'true').lower() == 'true'
+    INTERVAL_SECONDS = float(os.getenv('LOOP_WATCHDOG_INTERVAL_SECONDS', 0.5))
+    STALL_THRESHOLD_SECONDS = int(os.getenv('LOOP_LAG_THRESHOLD_MS', 250)) / 1000
+    REPORT_SECONDS = int(os.getenv('LOOP_LAG_REPORT_SECONDS', 5 * 60))  # 5 minutes
+    MAX_SAMPLES = 2000
+    MAX_STALLS = 50
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(LoopWatchdog, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        self.lag_samples: Deque[float] = deque(maxlen=self.MAX_SAMPLES)
+        self.stalls: Deque[Dict] = deque(maxlen=self.MAX_STALLS)
+        self.last_tick = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self._current_stall: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        """Start measuring the running event loop"""
+        if not self.ENABLED or self._task is not None:
+            return
+
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        Logger.info(f"Loop watchdog started, stall threshold {self.STALL_THRESHOLD_SECONDS * 1000:.0f}ms")
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _tick(self) -> None:
+        last_report = time.monotonic()
+        while not self._stop.is_set():
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.INTERVAL_SECONDS)
+            now = time.monotonic()
+            lag = max(now - scheduled - self.INTERVAL_SECONDS, 0.0)
+            self.lag_samples.append(lag)
+            self.last_tick = now
+
+            stall = self._current_stall
+            if stall is not None:
+                # The loop is running again, so we now know how long it was blocked
+                stall["duration_ms"] = round(lag * 1000)
+                self._current_stall = None
+                Logger.warn(f"Event loop was blocked for {stall['duration_ms']}ms in {stall['location']}")
+
+            if now - last_report >= self.REPORT_SECONDS:
+                last_report = now
+                Logger.info("Event loop lag percentiles", self.get_percentiles())
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.STALL_THRESHOLD_SECONDS / 2):
+            stale_for = time.monotonic() - self.last_tick - self.INTERVAL_SECONDS
+            if stale_for < self.STALL_THRESHOLD_SECONDS or self._current_stall is not None:
+                continue
+
+            frame = sys._current_frames().get(self.loop_thread_id)
+            if frame is None:
+                continue
+
+            stack = traceback.format_stack(frame)
+            stall = {
+                "detected_at": datetime.utcnow().isoformat(),
+                "location": self._blocking_location(traceback.extract_stack(frame)),
+                "duration_ms": None,
+                "stack": ''.join(stack[-15:])
+            }
+            self._current_stall = stall
+            self.stalls.append(stall)
+            # Log from this thread, the loop thread is the one that's stuck
+            Logger.warn(
+                f"Event loop blocked for over {stale_for * 1000:.0f}ms in {stall['location']}\n{stall['stack']}"
+            )
+
+    @staticmethod
+    def _blocking_location(stack: traceback.StackSummary) -> str:
+        """Innermost frame in this project's code, which is usually the call that blocks"""
+        project_root = Logger.get_project_root()
+        for frame in reversed(stack):
+            if frame.filename.startswith(project_root) and not frame.filename.endswith('LoopWatchdog.py'):
+                return f"{os.path.relpath(frame.filename, project_root)}:{frame.lineno} ({frame.name})"
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} ({frame.name})"
+
+    def get_percentiles(self) -> Dict[str, float]:
+        """Lag percentiles in milliseconds over the recent samples"""
+        samples = sorted(self.lag_samples)
+        if not samples:
+            return {}
+
+        def percentile(p: float) -> float:
+            return round(samples[min(int(len(samples) * p), len(samples) - 1)] * 1000, 1)
+
+        return {
+            "samples": len(samples),
+            "p50_ms": percentile(0.50),
+            "p90_ms": percentile(0.90),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(samples[-1] * 1000, 1),
+            "stalls": len(self.stalls)
+        }
+
+    def get_recent_stalls(self, limit: int = 5) -> List[Dict]:
+        return list(self.stalls)[-limit:]
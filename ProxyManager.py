@@ -1,17 +1,33 @@
+import asyncio
 import os
+import time
 from random import shuffle
 
 import aiohttp
-from typing import Dict, List
+from typing import Dict, List, Optional, Set
+from CircuitBreaker import NETWORK, FetchError
 from Logger import Logger
 from dotenv import load_dotenv
 
 load_dotenv()
 
+proxy_probe_url = os.getenv('PROXY_PROBE_URL', 'https://www.theperfumeshop.com/robots.txt')
+proxy_probe_timeout_seconds = int(os.getenv('PROXY_PROBE_TIMEOUT_SECONDS', 5))
+proxy_probe_concurrency = int(os.getenv('PROXY_PROBE_CONCURRENCY', 20))
+# Most preferred first, the site is hosted in the UK
+proxy_preferred_countries = [code.strip() for code in os.getenv('PROXY_PREFERRED_COUNTRIES', 'GB,IE,NL,BE,FR,DE').split(',') if code.strip()]
+proxy_excluded_countries = {code.strip() for code in os.getenv('PROXY_EXCLUDED_COUNTRIES', 'US').split(',') if code.strip()}
+
 
 class ProxyManager:
     _instance = None
     MAX_PROXY_USES = 100
+    # How many candidates to probe, preferred regions first
+    MAX_PROBE_CANDIDATES = int(os.getenv('PROXY_MAX_PROBE_CANDIDATES', 100))
+    FAST_TIER_SIZE = int(os.getenv('PROXY_FAST_TIER_SIZE', 20))
+    REPROBE_SECONDS = int(os.getenv('PROXY_REPROBE_SECONDS', 15 * 60))  # 15 minutes
+    # Added to the measured RTT of proxies outside the preferred countries when ranking
+    REGION_PENALTY_MS = int(os.getenv('PROXY_REGION_PENALTY_MS', 150))
 
     def __new__(cls):
         if cls._instance is None:
@@ -23,16 +39,27 @@ class ProxyManager:
         if self._initialized:
             return
 
+        # Fast tier, handed out round-robin
         self.proxies: List[Dict[str, str]] = []
+        # Reachable but slower proxies, used when the fast tier is empty
+        self.standby_proxies: List[Dict[str, str]] = []
+        self.last_probe_at: float = 0.0
+        # Every proxy URL covered by the last probe, reachable or not
+        self.probed: Set[str] = set()
+        self._reprobe_task: Optional[asyncio.Task] = None
         self.current_index: int = 0
         self.uses_count: int = 0
+        # Serializes pool refreshes when many fetches run concurrently
+        self._refresh_lock = asyncio.Lock()
         self._initialized = True
         Logger.info("ProxyManager initialized")
 
     async def initialize(self):
         """Initialize the proxy pool on first use"""
         if not self.proxies:
-            await self._fetch_proxies()
+            async with self._refresh_lock:
+                if not self.proxies:
+                    await self._fetch_proxies()
 
     async def _fetch_proxies(self) -> None:
         """Fetch proxies from Webshare API"""
@@ -66,7 +93,7 @@ class ProxyManager:
                                 break
 
                             for proxy in proxies_list:
-                                if proxy['country_code'] != 'US':
+                                if proxy['country_code'] not in proxy_excluded_countries:
                                     proxy[
                                         'http'] = f"http://{proxy['username']}:{proxy['password']}@{proxy['proxy_address']}:{proxy['port']}"
                                     formatted_proxies.append(proxy)
@@ -80,26 +107,141 @@ class ProxyManager:
                         break
 
             shuffle(formatted_proxies)
-            self.proxies = formatted_proxies
+            rankings_fresh = self.proxies and time.monotonic() - self.last_probe_at < self.REPROBE_SECONDS
+            if rankings_fresh and formatted_proxies:
+                # Rankings are still fresh, don't probe the whole pool again on every refresh
+                self._retain_tiers(formatted_proxies)
+            if not rankings_fresh or not (self.proxies or self.standby_proxies):
+                await self._build_tiers(formatted_proxies)
             self.current_index = 0
             self.uses_count = 0
 
-            Logger.info(f"Successfully loaded {len(self.proxies)} proxies")
+            Logger.info(f"Successfully loaded {len(self.proxies)} fast and {len(self.standby_proxies)} standby proxies")
         except Exception as e:
             Logger.error("Fatal error in proxy fetching", e)
             raise
 
-    async def get_proxy(self) -> Dict[str, str]:
-        """Get next proxy using round-robin method"""
+    @staticmethod
+    def _region_rank(proxy: Dict) -> int:
+        country_code = proxy.get('country_code')
+        if country_code in proxy_preferred_countries:
+            return proxy_preferred_countries.index(country_code)
+        return len(proxy_preferred_countries)
+
+    async def _probe(self, session: aiohttp.ClientSession, proxy: Dict, semaphore: asyncio.Semaphore) -> Optional[float]:
+        """Return the round-trip time in milliseconds of a request through the proxy, or None if it failed"""
+        async with semaphore:
+            started_at = time.perf_counter()
+            try:
+                async with session.get(
+                        proxy_probe_url,
+                        proxy=proxy['http'],
+                        timeout=aiohttp.ClientTimeout(total=proxy_probe_timeout_seconds)
+                ) as response:
+                    await response.read()
+                    if response.status >= 500:
+                        return None
+            except Exception:
+                return None
+            return (time.perf_counter() - started_at) * 1000
+
+    async def _build_tiers(self, candidates: List[Dict]) -> None:
+        """Probe candidates and split them into fast and standby tiers by RTT and region"""
+        # Stable sort keeps the shuffle within each region
+        candidates = sorted(candidates, key=self._region_rank)[:self.MAX_PROBE_CANDIDATES]
+        if not candidates:
+            # An empty fetch is more likely an API hiccup than a dead pool, so keep what we have
+            Logger.warn("No proxies to probe, keeping the current pool")
+            return
 
-        if self.uses_count >= self.MAX_PROXY_USES:
-            Logger.info("Proxy use limit reached, refreshing proxies")
-            await self._fetch_proxies()
+        semaphore = asyncio.Semaphore(proxy_probe_concurrency)
+        async with aiohttp.ClientSession() as session:
+            rtts = await asyncio.gather(*(self._probe(session, proxy, semaphore) for proxy in candidates))
+
+        reachable = []
+        for proxy, rtt in zip(candidates, rtts):
+            if rtt is None:
+                continue
+            proxy['rtt_ms'] = round(rtt, 1)
+            penalty = 0 if proxy.get('country_code') in proxy_preferred_countries else self.REGION_PENALTY_MS
+            proxy['score'] = rtt + penalty
+            reachable.append(proxy)
+
+        self.last_probe_at = time.monotonic()
+        self.probed = {proxy['http'] for proxy in candidates}
+        if not reachable:
+            # The probe endpoint itself may be down, fall back to the unranked pool
+            Logger.warn(f"No proxy answered the probe to {proxy_probe_url}, using {len(candidates)} unranked proxies")
+            self.proxies, self.standby_proxies = candidates, []
+            return
 
-        proxy = self.proxies[self.current_index]
+        reachable.sort(key=lambda proxy: proxy['score'])
+        self.proxies = reachable[:self.FAST_TIER_SIZE]
+        self.standby_proxies = reachable[self.FAST_TIER_SIZE:]
+        Logger.info(f"Probed {len(candidates)} proxies, {len(reachable)} reachable", self.get_tier_stats())
 
-        self.current_index = (self.current_index + 1) % len(self.proxies)
-        self.uses_count += 1
+    def _retain_tiers(self, candidates: List[Dict]) -> None:
+        """Keep the current ranking for proxies still in the pool and queue unprobed ones at the end of standby"""
+        available = {proxy['http'] for proxy in candidates}
+        self.proxies = [proxy for proxy in self.proxies if proxy['http'] in available]
+        self.standby_proxies = [proxy for proxy in self.standby_proxies if proxy['http'] in available] + \
+                               [proxy for proxy in candidates if proxy['http'] not in self.probed]
 
-        Logger.debug("Providing proxy", proxy)
+    async def _reprobe(self) -> None:
+        """Re-rank the current pool in the background without refetching it"""
+        try:
+            async with self._refresh_lock:
+                if self.proxies or self.standby_proxies:
+                    await self._build_tiers(self.proxies + self.standby_proxies)
+                    self.current_index = 0
+                else:
+                    await self._fetch_proxies()
+        except Exception as e:
+            Logger.error("Error re-probing proxies", e)
+
+    def get_tier_stats(self) -> Dict[str, Dict]:
+        """Latency distribution and countries per tier"""
+        stats = {}
+        for tier, proxies in (('fast', self.proxies), ('standby', self.standby_proxies)):
+            rtts = sorted(proxy['rtt_ms'] for proxy in proxies if 'rtt_ms' in proxy)
+            countries: Dict[str, int] = {}
+            for proxy in proxies:
+                countries[proxy.get('country_code')] = countries.get(proxy.get('country_code'), 0) + 1
+            stats[tier] = {
+                "count": len(proxies),
+                "p50_ms": rtts[len(rtts) // 2] if rtts else None,
+                "p90_ms": rtts[min(int(len(rtts) * 0.9), len(rtts) - 1)] if rtts else None,
+                "max_ms": rtts[-1] if rtts else None,
+                "countries": countries
+            }
+        return stats
+
+    async def get_proxy(self) -> Dict[str, str]:
+        """Get next proxy from the fast tier using round-robin method"""
+
+        if self.uses_count >= self.MAX_PROXY_USES:
+            async with self._refresh_lock:
+                # Another fetch may have refreshed the pool while we waited
+                if self.uses_count >= self.MAX_PROXY_USES:
+                    Logger.info("Proxy use limit reached, refreshing proxies")
+                    await self._fetch_proxies()
+
+        if time.monotonic() - self.last_probe_at > self.REPROBE_SECONDS and \
+                (self._reprobe_task is None or self._reprobe_task.done()):
+            self._reprobe_task = asyncio.create_task(self._reprobe())
+
+        if not (self.proxies or self.standby_proxies):
+            async with self._refresh_lock:
+                if not (self.proxies or self.standby_proxies):
+                    Logger.warn("Proxy pool is empty, refetching proxies")
+                    await self._fetch_proxies()
+
+        pool = self.proxies or self.standby_proxies
+        if not pool:
+            raise FetchError(NETWORK, "No proxies available")
+        self.current_index %= len(pool)
+        proxy = pool[self.current_index]
+
+        self.current_index = (self.current_index + 1) % len(pool)
+        self.uses_count += 1
         return proxy
@@ -0,0 +1,128 @@
+import os
+import random
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+from dotenv import load_dotenv
+
+from DatabaseManager import DatabaseManager
+from Logger import Logger
+
+load_dotenv()
+
+# Each user agent is paired with the client hints that browser actually sends
+BROWSER_FINGERPRINTS = [
+    {
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
+        'sec-ch-ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Google Chrome";v="122"',
+    },
+    {
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0',
+        'sec-ch-ua': '"Not A(Brand";v="99", "Microsoft Edge";v="121", "Chromium";v="121"',
+    },
+    {
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36 OPR/108.0.0.0',
+        'sec-ch-ua': '"Chromium";v="122", "Not(A:Brand";v="24", "Opera";v="108"',
+    },
+    {
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Vivaldi/6.5.3206.63',
+        'sec-ch-ua': '"Not A(Brand";v="99", "Chromium";v="121"',
+    },
+]
+
+# Responses that mean the site has flagged this visitor
+BAN_STATUSES = {403, 429}
+CHALLENGE_MARKERS = ('captcha', '_Incapsula_Resource', 'cf-chl', 'Access Denied', 'Pardon Our Interruption')
+
+
+class SessionManager:
+    """
+    Pairs each proxy with a persistent cookie jar and a consistent browser fingerprint.
+
+    The same proxy keeps looking like the same returning visitor across fetches and restarts,
+    until a ban is detected and the pair is rotated to a fresh fingerprint and empty jar.
+    """
+    _instance = None
+    SAVE_BATCH_SIZE = int(os.getenv('PROXY_SESSION_SAVE_BATCH_SIZE', 20))
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(SessionManager, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        self.sessions: Optional[Dict[str, Dict]] = None
+        self.dirty: Set[str] = set()
+
+    def _load(self) -> Dict[str, Dict]:
+        if self.sessions is None:
+            try:
+                self.sessions = {session['http']: session for session in DatabaseManager().get_proxy_sessions()}
+                Logger.info(f"Loaded {len(self.sessions)} proxy sessions")
+            except Exception as e:
+                Logger.error("Failed to load proxy sessions, starting with fresh ones", e)
+                self.sessions = {}
+        return self.sessions
+
+    @staticmethod
+    def _new_session(proxy_http: str) -> Dict:
+        return {
+            "http": proxy_http,
+            "fingerprint": random.choice(BROWSER_FINGERPRINTS),
+            "cookies": {},
+            "uses": 0,
+            "rotations": 0,
+            "created_at": datetime.utcnow()
+        }
+
+    def get_session(self, proxy_http: str) -> Dict:
+        """Return the session paired with a proxy, creating one on first use"""
+        sessions = self._load()
+        session = sessions.get(proxy_http)
+        if session is None:
+            session = self._new_session(proxy_http)
+            sessions[proxy_http] = session
+            self.dirty.add(proxy_http)
+        session["uses"] = session.get("uses", 0) + 1
+        return session
+
+    def update_cookies(self, proxy_http: str, cookies: Dict[str, str]) -> None:
+        session = self._load().get(proxy_http)
+        if session is None or session["cookies"] == cookies:
+            return
+
+        session["cookies"] = cookies
+        self.dirty.add(proxy_http)
+        if len(self.dirty) >= self.SAVE_BATCH_SIZE:
+            self.save()
+
+    def rotate(self, proxy_http: str, reason: str) -> None:
+        """Replace a banned session with a fresh fingerprint and an empty cookie jar"""
+        sessions = self._load()
+        rotations = sessions.get(proxy_http, {}).get("rotations", 0) + 1
+        session = self._new_session(proxy_http)
+        session["rotations"] = rotations
+        sessions[proxy_http] = session
+        self.dirty.add(proxy_http)
+        Logger.warn(f"Rotated session for proxy after ban: {reason}")
+
+    @staticmethod
+    def is_challenge_page(content: str) -> bool:
+        return any(marker in content for marker in CHALLENGE_MARKERS)
+
+    def save(self) -> None:
+        """Persist changed sessions in one bulk write"""
+        if not self.dirty or self.sessions is None:
+            return
+
+        dirty, self.dirty = self.dirty, set()
+        try:
+            DatabaseManager().save_proxy_sessions([self.sessions[proxy_http] for proxy_http in dirty])
+        except Exception as e:
+            self.dirty |= dirty
+            Logger.error(f"Failed to save {len(dirty)} proxy sessions", e)
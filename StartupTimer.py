@@ -0,0 +1,40 @@
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, TypeVar
+
+from Logger import Logger
+
+T = TypeVar('T')
+
+
+class StartupTimer:
+    """Records how long each startup phase took, measured from process start"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.reported = False
+
+    @contextmanager
+    def phase(self, name: str):
+        phase_started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - phase_started_at
+
+    async def timed(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Await `awaitable` and record its duration, so concurrent phases can be timed separately"""
+        with self.phase(name):
+            return await awaitable
+
+    def mark(self, name: str, since: float) -> None:
+        """Record a phase that started at the perf_counter value `since` and ends now"""
+        self.phases[name] = time.perf_counter() - since
+
+    def report(self) -> Dict[str, str]:
+        breakdown = {name: f"{seconds:.3f}s" for name, seconds in self.phases.items()}
+        breakdown['total'] = f"{time.perf_counter() - self.started_at:.3f}s"
+        self.reported = True
+        Logger.info("Startup phase breakdown", breakdown)
+        return breakdown
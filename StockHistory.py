@@ -0,0 +1,180 @@
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from pymongo import ASCENDING
+from pymongo.errors import CollectionInvalid, OperationFailure, PyMongoError
+
+from DatabaseManager import DatabaseManager
+from Logger import Logger
+from models import ProductData
+
+load_dotenv()
+
+
+class StockHistory:
+    """
+    Append-only stock level, status and price history per variant.
+
+    Points are buffered and written in batches, and a variant is only written when something changed
+    or the heartbeat interval passed, which keeps storage bounded with frequent sweeps.
+    """
+    _instance = None
+    RETENTION_DAYS = int(os.getenv('STOCK_HISTORY_RETENTION_DAYS', 90))
+    BATCH_SIZE = int(os.getenv('STOCK_HISTORY_BATCH_SIZE', 200))
+    HEARTBEAT_SECONDS = int(os.getenv('STOCK_HISTORY_HEARTBEAT_SECONDS', 24 * 60 * 60))  # 1 day
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(StockHistory, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        self.history_collection = 'stock_history'
+        self.db = DatabaseManager().db
+        self.buffer: List[Dict] = []
+        # Last written (stock_level, stock_status, price, timestamp) per variant code
+        self.last_points: Dict[str, Tuple] = {}
+        self._create_collection()
+
+    def _create_collection(self) -> None:
+        """Create the history as a time-series collection, falling back to a regular one with a TTL index"""
+        retention_seconds = self.RETENTION_DAYS * 24 * 60 * 60
+        try:
+            self.db.create_collection(
+                self.history_collection,
+                timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "hours"},
+                expireAfterSeconds=retention_seconds
+            )
+            Logger.info("Created stock history time-series collection")
+        except CollectionInvalid:
+            # Already exists
+            pass
+        except OperationFailure as e:
+            Logger.warn("Time-series collections not supported, using a regular collection for stock history", str(e))
+            try:
+                self.db[self.history_collection].create_index(
+                    "timestamp", expireAfterSeconds=retention_seconds
+                )
+            except PyMongoError as e:
+                Logger.error("Failed to create stock history TTL index", e)
+                raise
+
+        try:
+            # Range queries are always for one variant over a time window
+            self.db[self.history_collection].create_index(
+                [("meta.product_code", ASCENDING), ("timestamp", ASCENDING)]
+            )
+        except PyMongoError as e:
+            Logger.error("Failed to create stock history indexes", e)
+            raise
+
+    @staticmethod
+    def parse_price(formatted_price: str) -> Optional[float]:
+        match = re.search(r'\d+(?:[.,]\d+)?', (formatted_price or '').replace(',', ''))
+        return float(match.group()) if match else None
+
+    def record(self, product_data: ProductData) -> None:
+        """Buffer a history point for every variant of a fetched product that changed"""
+        now = datetime.utcnow()
+        for option in product_data.options:
+            price = self.parse_price(option.formatted_price)
+            last_point = self.last_points.get(option.product_code)
+            if last_point is not None and last_point[:3] == (option.stock_level, option.stock_status, price) \
+                    and now - last_point[3] < timedelta(seconds=self.HEARTBEAT_SECONDS):
+                continue
+
+            self.last_points[option.product_code] = (option.stock_level, option.stock_status, price, now)
+            self.buffer.append({
+                "timestamp": now,
+                "meta": {
+                    "product_code": option.product_code,
+                    "parent_code": product_data.product_code
+                },
+                "name": option.name,
+                "stock_level": option.stock_level,
+                "stock_status": option.stock_status,
+                "is_in_stock": option.is_in_stock,
+                "price": price,
+                "formatted_price": option.formatted_price
+            })
+
+        if len(self.buffer) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self) -> int:
+        """Write buffered history points in one batch"""
+        if not self.buffer:
+            return 0
+
+        points, self.buffer = self.buffer, []
+        try:
+            self.db[self.history_collection].insert_many(points, ordered=False)
+            Logger.debug(f"Wrote {len(points)} stock history points")
+            return len(points)
+        except PyMongoError as e:
+            # Forget what was written so the next sweep records these variants again
+            for point in points:
+                self.last_points.pop(point["meta"]["product_code"], None)
+            Logger.error(f"Failed to write {len(points)} stock history points", e)
+            return 0
+
+    def get_history(self, product_code: str, since: datetime, until: Optional[datetime] = None) -> List[Dict]:
+        """Return raw history points for a variant in a time range, oldest first"""
+        try:
+            return list(self.db[self.history_collection].find(
+                {
+                    "meta.product_code": product_code,
+                    "timestamp": {"$gte": since, "$lte": until or datetime.utcnow()}
+                },
+                {"_id": 0, "meta": 0}
+            ).sort("timestamp", ASCENDING))
+        except PyMongoError as e:
+            Logger.error(f"Failed to fetch stock history for {product_code}", e)
+            raise
+
+    @staticmethod
+    def _bucket_start(unit: str) -> Dict:
+        """Start of the hour or day bucket of a point, built from date parts as $dateTrunc needs MongoDB 5.0"""
+        parts = {"year": {"$year": "$timestamp"}, "month": {"$month": "$timestamp"}, "day": {"$dayOfMonth": "$timestamp"}}
+        if unit == 'hour':
+            parts["hour"] = {"$hour": "$timestamp"}
+        elif unit != 'day':
+            raise ValueError(f"Unsupported history bucket unit: {unit}")
+        return {"$dateFromParts": parts}
+
+    def get_downsampled_history(self, product_code: str, since: datetime, until: Optional[datetime] = None,
+                                unit: str = 'day') -> List[Dict]:
+        """
+        Return history for a variant aggregated into `unit` buckets ('hour' or 'day'), oldest first
+        Each bucket has min/max/last stock level, the last status and the price range
+        """
+        try:
+            return list(self.db[self.history_collection].aggregate([
+                {"$match": {
+                    "meta.product_code": product_code,
+                    "timestamp": {"$gte": since, "$lte": until or datetime.utcnow()}
+                }},
+                {"$sort": {"timestamp": 1}},
+                {"$group": {
+                    "_id": self._bucket_start(unit),
+                    "min_stock_level": {"$min": "$stock_level"},
+                    "max_stock_level": {"$max": "$stock_level"},
+                    "last_stock_level": {"$last": "$stock_level"},
+                    "last_stock_status": {"$last": "$stock_status"},
+                    "min_price": {"$min": "$price"},
+                    "max_price": {"$max": "$price"},
+                    "points": {"$sum": 1}
+                }},
+                {"$sort": {"_id": 1}}
+            ]))
+        except PyMongoError as e:
+            Logger.error(f"Failed to fetch downsampled stock history for {product_code}", e)
+            raise
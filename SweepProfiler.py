@@ -0,0 +1,141 @@
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from Logger import Logger
+
+load_dotenv()
+
+# Source file fragments used to attribute profiled time to the parts of a sweep
+CATEGORIES = [
+    ('proxies', ('ProxyManager',)),
+    ('beautifulsoup', ('bs4', 'html', 'soupsieve')),
+    ('json', ('json',)),
+    ('pymongo', ('pymongo', 'bson')),
+    ('aiohttp', ('aiohttp', 'yarl', 'multidict', 'ssl')),
+    ('discord', ('discord',)),
+    ('logging', ('Logger', 'logging', 'inspect', 'traceback')),
+    ('asyncio', ('asyncio', 'selectors')),
+]
+
+_NULL_CONTEXT = nullcontext()
+
+
+class SweepProfiler:
+    """
+    Opt-in cProfile and tracemalloc capture around one sweep.
+
+    Disabled unless PROFILE_SWEEPS=true or a capture is forced, in which case the per-product hooks
+    return a shared no-op context and cost nothing.
+    """
+    ENABLED = os.getenv('PROFILE_SWEEPS', 'false').lower() == 'true'
+    TOP_FUNCTIONS = int(os.getenv('PROFILE_TOP_FUNCTIONS', 40))
+    PROFILES_DIR = os.path.join(Logger.get_project_root(), 'profiles')
+
+    _active: Optional['SweepProfiler'] = None
+    last_report_path: Optional[str] = None
+
+    def __init__(self, label: str):
+        self.label = label
+        self.profile = cProfile.Profile()
+        self.product_peaks: List[Tuple[str, int, float]] = []
+        self.started_at = time.perf_counter()
+
+    @staticmethod
+    @asynccontextmanager
+    async def capture(label: str, force: bool = False):
+        """Profile the enclosed block and write a ranked report, yields the profiler or None when off"""
+        if not (force or SweepProfiler.ENABLED) or SweepProfiler._active is not None:
+            yield None
+            return
+
+        profiler = SweepProfiler(label)
+        SweepProfiler._active = profiler
+        started_tracemalloc = not tracemalloc.is_tracing()
+        if started_tracemalloc:
+            tracemalloc.start()
+        profiler.profile.enable()
+        try:
+            yield profiler
+        finally:
+            profiler.profile.disable()
+            SweepProfiler._active = None
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            SweepProfiler.last_report_path = profiler.write_report(snapshot)
+
+    @staticmethod
+    def is_capturing() -> bool:
+        return SweepProfiler._active is not None
+
+    @staticmethod
+    def track_product(product_url: str):
+        """Record peak memory while checking one product, a no-op unless a capture is running"""
+        if SweepProfiler._active is None:
+            return _NULL_CONTEXT
+        return SweepProfiler._active._track_product(product_url)
+
+    @contextmanager
+    def _track_product(self, product_url: str):
+        tracemalloc.reset_peak()
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            self.product_peaks.append((product_url, peak, time.perf_counter() - started_at))
+
+    def category_breakdown(self, stats: pstats.Stats) -> Dict[str, float]:
+        """Sum own time per category of source files"""
+        totals: Dict[str, float] = {}
+        for (filename, _, _), (_, _, own_time, _, _) in stats.stats.items():
+            category = next(
+                (name for name, fragments in CATEGORIES if any(fragment in filename for fragment in fragments)),
+                'other'
+            )
+            totals[category] = totals.get(category, 0.0) + own_time
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def write_report(self, snapshot: tracemalloc.Snapshot) -> str:
+        os.makedirs(self.PROFILES_DIR, exist_ok=True)
+        base_name = f"{self.label}-{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        report_path = os.path.join(self.PROFILES_DIR, f"{base_name}.txt")
+
+        # Keep the raw stats for snakeviz or pstats
+        self.profile.dump_stats(os.path.join(self.PROFILES_DIR, f"{base_name}.prof"))
+
+        output = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=output)
+        output.write(f"Profile of {self.label}, {time.perf_counter() - self.started_at:.2f}s wall time\n\n")
+
+        output.write("Own time by category\n")
+        for category, seconds in self.category_breakdown(stats).items():
+            output.write(f"  {category:<15} {seconds:10.3f}s\n")
+
+        output.write(f"\nTop {self.TOP_FUNCTIONS} functions by cumulative time\n")
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.TOP_FUNCTIONS)
+        output.write(f"\nTop {self.TOP_FUNCTIONS} functions by own time\n")
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.TOP_FUNCTIONS)
+
+        output.write("\nPeak traced memory per product\n")
+        for product_url, peak, seconds in sorted(self.product_peaks, key=lambda item: item[1], reverse=True):
+            output.write(f"  {peak / 1024:10.1f} KiB {seconds:8.2f}s  {product_url}\n")
+
+        output.write("\nTop allocation sites still held at the end of the run\n")
+        for statistic in snapshot.statistics('lineno')[:20]:
+            output.write(f"  {statistic}\n")
+
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(output.getvalue())
+
+        Logger.info(f"Wrote profile report to {report_path}")
+        return report_path
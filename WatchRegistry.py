@@ -0,0 +1,266 @@
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo.errors import OperationFailure, PyMongoError
+
+from DatabaseManager import DatabaseManager
+from Logger import Logger
+from utils import normalize_product_url
+
+load_dotenv()
+
+# MongoDB error code for change streams on a standalone server
+CHANGE_STREAMS_NOT_SUPPORTED = 40573
+
+
+class _RegistryCollection:
+    """In-memory copy of one field of a collection, keyed by document _id"""
+
+    def __init__(self, collection_name: str, field: str):
+        self.collection_name = collection_name
+        self.field = field
+        self.values: Set[str] = set()
+        self.ids: Dict[ObjectId, str] = {}
+
+    def read(self, db) -> Dict[ObjectId, str]:
+        """Read the collection without touching the in-memory state"""
+        return {document["_id"]: document[self.field] for document in db[self.collection_name].find({}, {self.field: 1})}
+
+    def replace(self, ids: Dict[ObjectId, str]) -> None:
+        self.ids = ids
+        self.values = set(ids.values())
+
+    def apply_change(self, change: Dict) -> None:
+        operation = change["operationType"]
+        document_id = change.get("documentKey", {}).get("_id")
+
+        if operation in ("insert", "replace", "update"):
+            document = change.get("fullDocument")
+            if document is None:
+                # Deleted again before the update was looked up, the delete event follows
+                return
+            previous_value = self.ids.get(document_id)
+            if previous_value is not None and previous_value != document[self.field]:
+                self.values.discard(previous_value)
+            self.ids[document_id] = document[self.field]
+            self.values.add(document[self.field])
+        elif operation == "delete":
+            value = self.ids.pop(document_id, None)
+            if value is not None:
+                self.values.discard(value)
+        elif operation == "drop":
+            self.ids = {}
+            self.values = set()
+
+    def add(self, value: str) -> None:
+        self.values.add(value)
+
+    def remove(self, value: str) -> None:
+        self.values.discard(value)
+        for document_id in [document_id for document_id, known in self.ids.items() if known == value]:
+            del self.ids[document_id]
+
+
+class WatchRegistry:
+    """
+    In-memory watch list and notification channel registry.
+
+    Loaded once and kept current through a MongoDB change stream, or by polling when the server
+    doesn't support change streams. Writes made through the registry are reflected immediately.
+    """
+    _instance = None
+    POLL_SECONDS = int(os.getenv('WATCH_REGISTRY_POLL_SECONDS', 30))
+    RETRY_SECONDS = 5
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super(WatchRegistry, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if self._initialized:
+            return
+
+        self._initialized = True
+        self.db_manager = DatabaseManager()
+        self.products = _RegistryCollection(self.db_manager.watch_products_collection, "product_url")
+        self.channels = _RegistryCollection(self.db_manager.notification_channels_collection, "channel_id")
+        self._collections = {
+            self.products.collection_name: self.products,
+            self.channels.collection_name: self.channels
+        }
+        self._lock = threading.Lock()
+        # Writes made through the registry while a reload is reading, replayed over the fresh state
+        self._writes_during_reload: Optional[List[Tuple[_RegistryCollection, str, str]]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def reload(self) -> None:
+        """Replace the in-memory state with a fresh read of both collections"""
+        with self._lock:
+            self._writes_during_reload = []
+        try:
+            # Read outside the lock, readers on the event loop must not wait on a round trip
+            loaded = {name: collection.read(self.db_manager.db) for name, collection in self._collections.items()}
+        except PyMongoError as e:
+            with self._lock:
+                self._writes_during_reload = None
+            Logger.error("Failed to load watch registry", e)
+            raise
+
+        with self._lock:
+            for name, ids in loaded.items():
+                self._collections[name].replace(ids)
+            # The read may have started before these writes reached the database
+            for collection, operation, value in self._writes_during_reload:
+                getattr(collection, operation)(value)
+            self._writes_during_reload = None
+
+    def _apply_write(self, collection: _RegistryCollection, operation: str, value: str) -> None:
+        with self._lock:
+            getattr(collection, operation)(value)
+            if self._writes_during_reload is not None:
+                self._writes_during_reload.append((collection, operation, value))
+
+    def start(self) -> None:
+        """Load the registry and keep it current in a background thread"""
+        if self._thread is not None:
+            return
+
+        self.reload()
+        Logger.info(f"Watch registry loaded {len(self.products.values)} products "
+                    f"and {len(self.channels.values)} channels")
+        self._thread = threading.Thread(target=self._follow_changes, name="watch-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _follow_changes(self) -> None:
+        resume_token = None
+        pipeline = [{"$match": {"ns.coll": {"$in": list(self._collections.keys())}}}]
+
+        if not hasattr(type(self.db_manager.db), 'watch'):
+            # Local stand-ins for MongoDB may not implement change streams at all
+            self._poll(f"{type(self.db_manager.db).__name__} has no watch()")
+            return
+
+        while not self._stop.is_set():
+            try:
+                with self.db_manager.db.watch(
+                        pipeline,
+                        full_document='updateLookup',
+                        resume_after=resume_token,
+                        max_await_time_ms=1000
+                ) as stream:
+                    if resume_token is None:
+                        # Catch up on anything that changed between the initial load and opening the stream
+                        self.reload()
+                        Logger.info("Watch registry following change stream")
+
+                    while not self._stop.is_set() and stream.alive:
+                        change = stream.try_next()
+                        if change is None:
+                            continue
+
+                        resume_token = stream.resume_token
+                        collection = self._collections.get(change.get("ns", {}).get("coll"))
+                        if change["operationType"] == "invalidate":
+                            resume_token = None
+                            break
+                        if collection is not None:
+                            with self._lock:
+                                collection.apply_change(change)
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_NOT_SUPPORTED:
+                    self._poll(str(e))
+                    return
+                Logger.warn("Watch registry change stream failed, restarting", str(e))
+                resume_token = None
+                time.sleep(self.RETRY_SECONDS)
+            except NotImplementedError as e:
+                self._poll(str(e) or "watch() not implemented")
+                return
+            except PyMongoError as e:
+                Logger.warn("Watch registry change stream interrupted, resuming", str(e))
+                time.sleep(self.RETRY_SECONDS)
+
+    def _poll(self, reason: str) -> None:
+        Logger.warn(f"Change streams unavailable, polling watch registry every {self.POLL_SECONDS}s", reason)
+        while not self._stop.wait(self.POLL_SECONDS):
+            try:
+                self.reload()
+            except PyMongoError:
+                # Already logged, keep serving the last known state
+                continue
+
+    def _ensure_loaded(self) -> None:
+        if self._thread is None:
+            self.start()
+
+    def get_watch_products(self) -> List[str]:
+        """Return all watched product URLs from memory"""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self.products.values)
+
+    def find_watch_products(self, product_urls: List[str]) -> Dict[str, str]:
+        """Map each of `product_urls` to the watched URL of the same variant, even one stored before normalizing"""
+        self._ensure_loaded()
+        with self._lock:
+            watched_urls = list(self.products.values)
+
+        watched_by_variant: Dict[str, str] = {}
+        for watched_url in watched_urls:
+            normalized = normalize_product_url(watched_url)
+            if normalized is not None:
+                watched_by_variant.setdefault(normalized[0], watched_url)
+
+        found = {}
+        for product_url in product_urls:
+            normalized = normalize_product_url(product_url)
+            if normalized is not None and normalized[0] in watched_by_variant:
+                found[product_url] = watched_by_variant[normalized[0]]
+        return found
+
+    def find_watch_product(self, product_url: str) -> Optional[str]:
+        return self.find_watch_products([product_url]).get(product_url)
+
+    def get_notification_channels(self) -> List[str]:
+        """Return all notification channel IDs from memory"""
+        self._ensure_loaded()
+        with self._lock:
+            return list(self.channels.values)
+
+    def add_watch_product(self, product_url: str) -> bool:
+        added = self.db_manager.add_watch_product(product_url)
+        if added:
+            self._apply_write(self.products, "add", product_url)
+        return added
+
+    def add_watch_products(self, product_urls: List[str]) -> Set[str]:
+        inserted = self.db_manager.add_watch_products(product_urls)
+        for product_url in inserted:
+            self._apply_write(self.products, "add", product_url)
+        return inserted
+
+    def remove_watch_product(self, product_url: str) -> bool:
+        removed = self.db_manager.remove_watch_product(product_url)
+        self._apply_write(self.products, "remove", product_url)
+        return removed
+
+    def add_discord_channel(self, channel_id: str) -> bool:
+        added = self.db_manager.add_discord_channel(channel_id)
+        if added:
+            self._apply_write(self.channels, "add", channel_id)
+        return added
+
+    def remove_discord_channel(self, channel_id: str) -> bool:
+        removed = self.db_manager.remove_discord_channel(channel_id)
+        self._apply_write(self.channels, "remove", channel_id)
+        return removed
@@ -0,0 +1,101 @@
+import argparse
+import json
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from bs4 import BeautifulSoup
+
+from CaptureArchive import CaptureArchive, iter_archive
+from Logger import Logger
+from utils import decode_product_entities, find_app_state, parse_product_page
+
+
+def load_pages(paths: List[str]) -> List[Tuple[str, str]]:
+    """Read (url, html) pairs of successful fetches from capture segments"""
+    # Timing passes over the pages repeatedly, so unlike replay these are held in memory
+    return [(meta["url"], body) for meta, body in iter_archive(paths, status=200)]
+
+
+def full_state_entities(content: str, product_code: str) -> Dict:
+    """The previous approach: parse the whole page and decode the whole app state"""
+    script_tag = BeautifulSoup(content, 'html.parser').find(id='spartacus-app-state')
+    cleaned_content = script_tag.string.replace('&q;', '"').replace('&l;', '<').replace('&g;', '>')
+    return json.loads(cleaned_content)['cx-state']['product']['details']['entities']
+
+
+def full_json_entities(content: str, product_code: str) -> Dict:
+    """Locate the script without an HTML parser but still decode the whole app state, isolating the JSON cost"""
+    cleaned_content = find_app_state(content).replace('&q;', '"').replace('&l;', '<').replace('&g;', '>')
+    return json.loads(cleaned_content)['cx-state']['product']['details']['entities']
+
+
+def selective_entities(content: str, product_code: str) -> Dict:
+    cleaned_content = find_app_state(content).replace('&q;', '"').replace('&l;', '<').replace('&g;', '>')
+    return decode_product_entities(cleaned_content, product_code)
+
+
+def measure(decode: Callable[[str, str], Dict], pages: List[Tuple[str, str, str]], repeat: int) -> Dict:
+    # Time without tracemalloc, it slows allocation heavy code down unevenly
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        for _, product_code, content in pages:
+            decode(content, product_code)
+    elapsed = time.perf_counter() - started_at
+
+    peaks = []
+    tracemalloc.start()
+    for _, product_code, content in pages:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        decode(content, product_code)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    peaks.sort()
+    return {
+        "ms_per_page": round(elapsed / (repeat * len(pages)) * 1000, 3),
+        "pages_per_second": round(repeat * len(pages) / elapsed, 1),
+        "peak_kib_p50": round(peaks[len(peaks) // 2] / 1024, 1),
+        "peak_kib_max": round(peaks[-1] / 1024, 1)
+    }
+
+
+def run_benchmark(paths: List[str], repeat: int) -> Dict[str, Dict]:
+    pages = []
+    for url, content in load_pages(paths):
+        product_code = url.rsplit('varSel=', 1)[-1]
+        if find_app_state(content) is not None:
+            pages.append((url, product_code, content))
+    if not pages:
+        raise SystemExit("No product pages found, capture some with CAPTURE_ENABLED=true first")
+
+    # Both decoders must agree before their speed means anything
+    for url, product_code, content in pages:
+        if full_state_entities(content, product_code)[product_code] != selective_entities(content, product_code)[product_code]:
+            raise SystemExit(f"Selective decoding returned a different product for {url}")
+        parse_product_page(content, url)
+
+    Logger.info(f"Benchmarking {len(pages)} pages, {sum(len(page[2]) for page in pages) / len(pages) / 1024:.0f} KiB on average")
+    return {
+        "full_state": measure(full_state_entities, pages, repeat),
+        "full_json": measure(full_json_entities, pages, repeat),
+        "selective": measure(selective_entities, pages, repeat),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare decoding the whole app state with decoding only the product entities"
+    )
+    parser.add_argument('paths', nargs='*', default=[CaptureArchive.CAPTURE_DIR],
+                        help="Capture segments or directories of them")
+    parser.add_argument('--repeat', type=int, default=5, help="Passes over the pages when timing")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.paths, args.repeat)
+    lines = [f"{'decoder':<12} {'ms/page':>9} {'pages/s':>9} {'peak p50 KiB':>13} {'peak max KiB':>13}"]
+    for name, result in results.items():
+        lines.append(f"{name:<12} {result['ms_per_page']:>9} {result['pages_per_second']:>9} "
+                     f"{result['peak_kib_p50']:>13} {result['peak_kib_max']:>13}")
+    Logger.info("Parser benchmark\n" + "\n".join(lines), no_meta=True)
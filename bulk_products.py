@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import csv
+import io
+import os
+from typing import Dict, Iterable, List, Optional, TextIO
+
+from dotenv import load_dotenv
+
+from DatabaseManager import DatabaseManager
+from FetchExecutor import FetchExecutor
+from Logger import Logger
+from WatchRegistry import WatchRegistry
+from utils import fetch_product_data, normalize_product_url
+
+load_dotenv()
+
+bulk_import_concurrency = int(os.getenv('BULK_IMPORT_CONCURRENCY', 10))
+bulk_import_max_retries = int(os.getenv('BULK_IMPORT_MAX_RETRIES', 3))
+
+
+def read_product_urls(lines: Iterable[str]) -> List[str]:
+    """Read one URL per line, ignoring blank lines and # comments"""
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+
+async def _validate_product(url: str, semaphore: asyncio.Semaphore) -> Optional[str]:
+    """Return None if the product can be watched, otherwise the reason it can't"""
+    async with semaphore:
+        try:
+            _, product_data = await fetch_product_data(
+                url, max_retries=bulk_import_max_retries, lane=FetchExecutor.BULK
+            )
+        except Exception as e:
+            return str(e)
+
+    if product_data is None:
+        return "Failed to fetch product data"
+    if product_data.get_watched_option() is None:
+        return "Product option to watch not found"
+    return None
+
+
+async def import_products(urls: List[str], concurrency: int = bulk_import_concurrency) -> List[Dict]:
+    """
+    Validate and add many product URLs
+    Returns one report entry per input URL with its status and detail
+    """
+    report: List[Dict] = []
+    to_validate: Dict[str, str] = {}
+    seen_product_codes: Dict[str, str] = {}
+
+    # Normalize and dedupe by variant code before doing any network work
+    for url in urls:
+        normalized = normalize_product_url(url)
+        if normalized is None:
+            report.append({"url": url, "status": "invalid", "detail": "Not a product URL containing '?varSel='"})
+            continue
+
+        product_url, product_code = normalized
+        if product_code in seen_product_codes:
+            report.append({"url": url, "status": "duplicate", "detail": f"Same product as {seen_product_codes[product_code]}"})
+            continue
+
+        seen_product_codes[product_code] = url
+        to_validate[product_url] = url
+
+    registry = WatchRegistry()
+    # Matches URLs stored before they were normalized too
+    for product_url, watched_url in registry.find_watch_products(list(to_validate.keys())).items():
+        report.append({"url": to_validate.pop(product_url), "status": "already_watched", "detail": watched_url})
+
+    Logger.info(f"Validating {len(to_validate)} products with concurrency {concurrency}")
+    semaphore = asyncio.Semaphore(concurrency)
+    product_urls = list(to_validate.keys())
+    failures = await asyncio.gather(*(_validate_product(product_url, semaphore) for product_url in product_urls))
+
+    valid_product_urls = []
+    for product_url, failure in zip(product_urls, failures):
+        if failure is None:
+            valid_product_urls.append(product_url)
+        else:
+            report.append({"url": to_validate[product_url], "status": "fetch_failed", "detail": failure})
+
+    inserted = await asyncio.to_thread(registry.add_watch_products, valid_product_urls)
+    for product_url in valid_product_urls:
+        if product_url in inserted:
+            report.append({"url": to_validate[product_url], "status": "added", "detail": product_url})
+        else:
+            # Added by someone else while we were validating
+            report.append({"url": to_validate[product_url], "status": "already_watched", "detail": product_url})
+
+    Logger.info(f"Bulk import finished, added {len(inserted)} of {len(urls)} URLs")
+    return report
+
+
+def write_import_report(report: List[Dict], output: TextIO) -> None:
+    writer = csv.DictWriter(output, fieldnames=["url", "status", "detail"])
+    writer.writeheader()
+    writer.writerows(report)
+
+
+def summarize_import_report(report: List[Dict]) -> Dict[str, int]:
+    summary: Dict[str, int] = {}
+    for entry in report:
+        summary[entry["status"]] = summary.get(entry["status"], 0) + 1
+    return summary
+
+
+def export_products(output: TextIO) -> int:
+    """Stream every watched product URL to `output`, one per line"""
+    count = 0
+    for product_url in DatabaseManager().iter_watch_products():
+        output.write(f"{product_url}\n")
+        count += 1
+    Logger.info(f"Exported {count} watch products")
+    return count
+
+
+def export_products_to_bytes() -> io.BytesIO:
+    output = io.StringIO()
+    export_products(output)
+    return io.BytesIO(output.getvalue().encode('utf-8'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import or export watched products")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Add product URLs from a file, one per line")
+    import_parser.add_argument('file')
+    import_parser.add_argument('--concurrency', type=int, default=bulk_import_concurrency)
+    import_parser.add_argument('--report', help="Write the per-URL result report to this CSV file")
+
+    export_parser = subparsers.add_parser('export', help="Write all watched product URLs to a file")
+    export_parser.add_argument('file')
+
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        with open(args.file, encoding='utf-8') as f:
+            input_urls = read_product_urls(f)
+
+        import_report = asyncio.run(import_products(input_urls, args.concurrency))
+        if args.report:
+            with open(args.report, 'w', newline='', encoding='utf-8') as f:
+                write_import_report(import_report, f)
+        Logger.info("Bulk import summary", summarize_import_report(import_report))
+    else:
+        with open(args.file, 'w', encoding='utf-8') as f:
+            export_products(f)
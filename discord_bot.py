@@ -1,18 +1,48 @@
+import asyncio
+import hashlib
+import io
+import json
 import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
 
 import discord
+from bson import ObjectId
 from discord import app_commands
 from Logger import Logger
 from dotenv import load_dotenv
 from discord.ext import tasks
+from BrowserPool import BrowserPool
 from DatabaseManager import DatabaseManager
-
-from utils import fetch_product_data
-from watch_stock_cron import watch_stock_cron
+from FetchExecutor import FetchExecutor
+from JobQueue import JobQueue
+from LoopWatchdog import LoopWatchdog
+from ProxyManager import ProxyManager
+from StartupTimer import StartupTimer
+from SweepProfiler import SweepProfiler
+from WatchRegistry import WatchRegistry
+
+from StockHistory import StockHistory
+from bulk_products import (export_products_to_bytes, import_products, read_product_urls, summarize_import_report,
+                           write_import_report)
+from utils import fetch_product_data, normalize_product_url
+from watch_stock_cron import process_alert_jobs, process_notification_jobs, sweep_lock, watch_stock_cron
 
 load_dotenv()
 
 watch_product_cron_delay_seconds = int(os.getenv('WATCH_PRODUCT_CRON_DELAY_SECONDS', 60 * 60))  # 1 hour
+# 'local' runs the sweep in this process, 'sharded' leaves it to sweep_worker.py processes
+sweep_mode = os.getenv('SWEEP_MODE', 'local')
+notification_queue_poll_seconds = int(os.getenv('NOTIFICATION_QUEUE_POLL_SECONDS', 15))
+product_list_page_size = int(os.getenv('PRODUCT_LIST_PAGE_SIZE', 20))
+product_list_view_timeout_seconds = int(os.getenv('PRODUCT_LIST_VIEW_TIMEOUT_SECONDS', 5 * 60))  # 5 minutes
+
+force_command_sync = os.getenv('FORCE_COMMAND_SYNC', 'false').lower() == 'true'
+
+EMBED_DESCRIPTION_LIMIT = 4096
+
+startup_timer = StartupTimer()
 
 
 class Bot(discord.Client):
@@ -22,9 +52,87 @@ class Bot(discord.Client):
         super().__init__(intents=intents)
         self.tree = app_commands.CommandTree(self)
         self.db = DatabaseManager()
+        self.registry = WatchRegistry()
+        self.setup_finished_at: Optional[float] = None
+        # Warm-ups that run past setup_hook, referenced so they aren't garbage collected mid-flight
+        self.warm_up_tasks: Set[asyncio.Task] = set()
 
     async def setup_hook(self):
+        setup_started_at = time.perf_counter()
+        LoopWatchdog().start()
+        # The proxy pool and browser aren't needed to connect, and the first fetch waits on their
+        # initialize()/start() locks until the warm-up holding them is done
+        self._start_warm_up('proxies', self._warm_up_proxies())
+        self._start_warm_up('browser_pool', self._warm_up_browser_pool())
+        # Commands need the database and the synced tree, so only these hold up the gateway connection
+        await asyncio.gather(
+            startup_timer.timed('database', asyncio.to_thread(self._warm_up_database)),
+            startup_timer.timed('command_sync', self.sync_command_tree()),
+        )
+        startup_timer.mark('setup_hook', setup_started_at)
+        self.setup_finished_at = time.perf_counter()
+
+    def _start_warm_up(self, name: str, coroutine) -> None:
+        task = asyncio.create_task(startup_timer.timed(name, coroutine), name=f"warm-up-{name}")
+        self.warm_up_tasks.add(task)
+        task.add_done_callback(self._on_warm_up_done)
+
+    def _on_warm_up_done(self, task: asyncio.Task) -> None:
+        self.warm_up_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            Logger.error(f"Startup task {task.get_name()} failed", task.exception())
+
+    def _warm_up_database(self):
+        """Connect and create indexes off the event loop"""
+        _ = self.db.db
+        JobQueue()
+        StockHistory()
+        self.registry.start()
+
+    @staticmethod
+    async def _warm_up_proxies():
+        try:
+            await ProxyManager().initialize()
+        except Exception as e:
+            # Not fatal, the pool is fetched again on the first product fetch
+            Logger.warn("Failed to load proxies during startup", str(e))
+
+    @staticmethod
+    async def _warm_up_browser_pool():
+        if not BrowserPool().available:
+            return
+        try:
+            await BrowserPool().start()
+        except Exception as e:
+            # Not fatal, the pool is started again on the first escalated fetch
+            Logger.warn("Failed to start browser pool during startup", str(e))
+
+    async def close(self):
+        for task in list(self.warm_up_tasks):
+            task.cancel()
+        await BrowserPool().close()
+        await super().close()
+
+    def get_command_tree_hash(self) -> str:
+        commands = sorted(
+            (command.to_dict(self.tree) for command in self.tree.get_commands()),
+            key=lambda command: command['name']
+        )
+        return hashlib.sha256(json.dumps(commands, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    async def sync_command_tree(self):
+        """Sync slash commands with Discord only when they changed since the last sync"""
+        state_key = f"command_tree_hash:{self.application_id}"
+        command_tree_hash = self.get_command_tree_hash()
+
+        if not force_command_sync:
+            stored_hash = await asyncio.to_thread(self.db.get_bot_state, state_key)
+            if stored_hash == command_tree_hash:
+                Logger.info("Command tree unchanged, skipping sync")
+                return
+
         await self.tree.sync()
+        await asyncio.to_thread(self.db.set_bot_state, state_key, command_tree_hash)
         Logger.info("Command tree synced")
 
 
@@ -37,18 +145,19 @@ async def add_product(interaction: discord.Interaction, url: str):
     await interaction.response.defer(thinking=True)
 
     try:
-        embed, product_data = await fetch_product_data(url, max_retries=5)
+        # Store the same canonical URL as bulk imports, so a variant is never watched twice
+        normalized = normalize_product_url(url)
+        if normalized is not None:
+            url = normalized[0]
+
+        embed, product_data = await fetch_product_data(url, max_retries=5, lane=FetchExecutor.INTERACTIVE)
         if product_data is None:
             await interaction.followup.send(
                 content="❌ Failed to fetch product data. Please make sure the URL is correct or try again."
             )
             return
 
-        option_to_watch = None
-        for opt in product_data.options:
-            if opt.product_code == product_data.product_code:
-                option_to_watch = opt
-                break
+        option_to_watch = product_data.get_watched_option()
 
         if option_to_watch is None:
             await interaction.followup.send(
@@ -56,7 +165,7 @@ async def add_product(interaction: discord.Interaction, url: str):
             )
             return
 
-        if client.db.add_watch_product(url):
+        if client.registry.find_watch_product(url) is None and client.registry.add_watch_product(url):
             embed = discord.Embed(
                 title=f"✅ {option_to_watch.name} Added",
                 url=option_to_watch.product_url,
@@ -87,7 +196,9 @@ async def remove_product(interaction: discord.Interaction, product_url: str):
     await interaction.response.defer(thinking=True)
 
     try:
-        if client.db.remove_watch_product(product_url):
+        # The watched URL may differ from the given one in tracking parameters
+        watched_url = client.registry.find_watch_product(product_url) or product_url
+        if client.registry.remove_watch_product(watched_url):
             embed = discord.Embed(
                 title="✅ Product Removed",
                 description=f"Stopped watching product: {product_url}",
@@ -110,21 +221,102 @@ async def remove_product(interaction: discord.Interaction, product_url: str):
     await interaction.followup.send(embed=embed)
 
 
+class ProductListView(discord.ui.View):
+    """Pages through the watch list with a range cursor on _id"""
+
+    def __init__(self, owner_id: int):
+        super().__init__(timeout=product_list_view_timeout_seconds)
+        self.owner_id = owner_id
+        self.products: List[Dict] = []
+        self.offset = 0
+        self.message: Optional[discord.Message] = None
+
+    def load_page(self, after_id: Optional[ObjectId] = None, before_id: Optional[ObjectId] = None):
+        # Fetch one extra product to know whether another page exists in that direction
+        products = client.db.get_watch_products_page(
+            product_list_page_size + 1, after_id=after_id, before_id=before_id
+        )
+        if before_id is not None:
+            has_previous = len(products) > product_list_page_size
+            products = products[-product_list_page_size:]
+            has_next = True
+            self.offset = max(self.offset - len(products), 0) if has_previous else 0
+        else:
+            has_previous = after_id is not None
+            has_next = len(products) > product_list_page_size
+            products = products[:product_list_page_size]
+            self.offset += len(self.products) if after_id is not None else 0
+
+        self.products = products
+        self.previous_page.disabled = not has_previous
+        self.next_page.disabled = not has_next
+
+    def build_embed(self) -> discord.Embed:
+        lines = []
+        description_length = 0
+        for i, product in enumerate(self.products):
+            line = f"{self.offset + i + 1}. {product['product_url']}"
+            if description_length + len(line) + 1 > EMBED_DESCRIPTION_LIMIT - 2:
+                lines.append("…")
+                break
+            lines.append(line)
+            description_length += len(line) + 1
+
+        embed = discord.Embed(
+            title="📋 Watched Products",
+            description="\n".join(lines) if lines else "No more products on this page.",
+            color=0x00ccff
+        )
+        embed.set_footer(
+            text=f"Showing {self.offset + 1}-{self.offset + len(self.products)} "
+                 f"of ~{client.db.count_watch_products()}"
+        )
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message(
+                content="❌ Only the user who ran this command can change pages.", ephemeral=True
+            )
+            return False
+        return True
+
+    async def on_timeout(self):
+        for item in self.children:
+            item.disabled = True
+        if self.message:
+            try:
+                await self.message.edit(view=self)
+            except discord.HTTPException as e:
+                Logger.warn("Failed to disable product list buttons", str(e))
+
+    @discord.ui.button(label="◀ Previous", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.load_page(before_id=self.products[0]["_id"] if self.products else None)
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="Next ▶", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.load_page(after_id=self.products[-1]["_id"] if self.products else None)
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+
 @client.tree.command(name="tps-list-products", description="Show all watched product URLs")
 async def list_products(interaction: discord.Interaction):
     Logger.info("Received list products request")
     await interaction.response.defer(thinking=True)
 
+    view = None
     try:
-        products = client.db.get_all_watch_products()
-        if products:
-            product_list = "\n".join([f"{i + 1}. {url}" for i, url in enumerate(products)])
-            embed = discord.Embed(
-                title="📋 Watched Products",
-                description=product_list,
-                color=0x00ccff
-            )
+        view = ProductListView(interaction.user.id)
+        view.load_page()
+        if view.products:
+            embed = view.build_embed()
+            if view.next_page.disabled:
+                # Everything fits on one page, no need for buttons
+                view = None
         else:
+            view = None
             embed = discord.Embed(
                 title="📋 Watched Products",
                 description="No products are currently being watched.",
@@ -132,13 +324,79 @@ async def list_products(interaction: discord.Interaction):
             )
     except Exception as e:
         Logger.error('Error listing products:', e)
+        view = None
         embed = discord.Embed(
             title="❌ Error",
             description=f"An error occurred while fetching the product list.\n{str(e)}",
             color=0xff0000
         )
 
-    await interaction.followup.send(embed=embed)
+    if view is None:
+        await interaction.followup.send(embed=embed)
+    else:
+        view.message = await interaction.followup.send(embed=embed, view=view, wait=True)
+
+
+@client.tree.command(name="tps-import-products", description="Add product URLs from a text file, one per line")
+@app_commands.checks.has_permissions(administrator=True)
+async def import_products_command(interaction: discord.Interaction, file: discord.Attachment):
+    Logger.info(f"Received import products request for file: {file.filename}")
+
+    # A large import can outlast the 15 minute interaction token, so the report goes to the channel
+    await interaction.response.send_message(
+        content=f"📥 Importing `{file.filename}`, the report will be posted in this channel when it finishes."
+    )
+    channel = interaction.channel
+
+    try:
+        content = (await file.read()).decode('utf-8-sig')
+        report = await import_products(read_product_urls(content.splitlines()))
+        summary = summarize_import_report(report)
+
+        report_file = io.StringIO()
+        write_import_report(report, report_file)
+        embed = discord.Embed(
+            title="📥 Import Finished",
+            description="\n".join(f"**{status}**: {count}" for status, count in summary.items()) or "File contained no URLs.",
+            color=0x00ff00
+        )
+        await channel.send(
+            content=f"Import of `{file.filename}` requested by {interaction.user.mention}",
+            embed=embed,
+            file=discord.File(io.BytesIO(report_file.getvalue().encode('utf-8')), filename="import-report.csv")
+        )
+        return
+    except Exception as e:
+        Logger.error('Error importing products:', e)
+        embed = discord.Embed(
+            title="❌ Error",
+            description=f"An error occurred while importing products.\n{str(e)}",
+            color=0xff0000
+        )
+
+    await channel.send(embed=embed)
+
+
+@client.tree.command(name="tps-export-products", description="Download all watched product URLs as a text file")
+async def export_products_command(interaction: discord.Interaction):
+    Logger.info("Received export products request")
+    await interaction.response.defer(thinking=True)
+
+    try:
+        # The cursor is read with blocking pymongo calls
+        export_file = await asyncio.to_thread(export_products_to_bytes)
+        await interaction.followup.send(
+            content="📤 Watched products export",
+            file=discord.File(export_file, filename="watched-products.txt")
+        )
+    except Exception as e:
+        Logger.error('Error exporting products:', e)
+        embed = discord.Embed(
+            title="❌ Error",
+            description=f"An error occurred while exporting products.\n{str(e)}",
+            color=0xff0000
+        )
+        await interaction.followup.send(embed=embed)
 
 
 @client.tree.command(name="tps-add-channel", description="Add a notification channel")
@@ -148,7 +406,7 @@ async def add_channel(interaction: discord.Interaction, channel: discord.TextCha
     await interaction.response.defer(thinking=True)
 
     try:
-        if client.db.add_discord_channel(str(channel.id)):
+        if client.registry.add_discord_channel(str(channel.id)):
             embed = discord.Embed(
                 title="✅ Channel Added",
                 description=f"Added {channel.mention} to notification channels.",
@@ -178,7 +436,7 @@ async def remove_channel(interaction: discord.Interaction, channel: discord.Text
     await interaction.response.defer(thinking=True)
 
     try:
-        if client.db.remove_discord_channel(str(channel.id)):
+        if client.registry.remove_discord_channel(str(channel.id)):
             embed = discord.Embed(
                 title="✅ Channel Removed",
                 description=f"Removed {channel.mention} from notification channels.",
@@ -207,7 +465,7 @@ async def list_channels(interaction: discord.Interaction):
     await interaction.response.defer(thinking=True)
 
     try:
-        channels = client.db.get_all_notification_channels()
+        channels = client.registry.get_notification_channels()
         if channels:
             channel_mentions = []
             for channel_id in channels:
@@ -245,7 +503,7 @@ async def check_stock(interaction: discord.Interaction, product_url: str):
     await interaction.response.defer()
 
     try:
-        embed, product = await fetch_product_data(product_url, max_retries=5)
+        embed, product = await fetch_product_data(product_url, max_retries=5, lane=FetchExecutor.INTERACTIVE)
 
         if product is None:
             await interaction.followup.send(
@@ -268,6 +526,162 @@ async def check_stock(interaction: discord.Interaction, product_url: str):
         await interaction.followup.send(embed=error_embed)
 
 
+@client.tree.command(name="tps-history", description="Show stock and price history of a product variant")
+@app_commands.describe(product_url="Product URL containing '?varSel='", days="How many days back to show")
+async def stock_history(interaction: discord.Interaction, product_url: str, days: app_commands.Range[int, 1, 90] = 7):
+    Logger.info(f"Received stock history request {product_url} for {days} days")
+    await interaction.response.defer(thinking=True)
+
+    try:
+        normalized = normalize_product_url(product_url)
+        if normalized is None:
+            await interaction.followup.send(
+                content="❌ Invalid URL. Must be a The Perfume Shop product URL containing '?varSel='."
+            )
+            return
+
+        _, product_code = normalized
+        # Hourly buckets are only readable for short windows
+        unit = 'hour' if days <= 2 else 'day'
+        buckets = StockHistory().get_downsampled_history(
+            product_code, datetime.utcnow() - timedelta(days=days), unit=unit
+        )
+
+        if buckets:
+            time_format = '%d %b %H:00' if unit == 'hour' else '%d %b'
+            lines = []
+            for bucket in buckets:
+                stock_range = str(bucket['min_stock_level']) if bucket['min_stock_level'] == bucket['max_stock_level'] \
+                    else f"{bucket['min_stock_level']}-{bucket['max_stock_level']}"
+                price = f"£{bucket['max_price']:.2f}" if bucket['max_price'] is not None else "n/a"
+                lines.append(
+                    f"`{bucket['_id'].strftime(time_format)}` stock {stock_range} "
+                    f"({bucket['last_stock_status']}), {price}"
+                )
+            # Keep the newest buckets if the history doesn't fit in one embed
+            while len("\n".join(lines)) > EMBED_DESCRIPTION_LIMIT:
+                lines.pop(0)
+
+            embed = discord.Embed(
+                title=f"📈 Stock History ({days} days)",
+                url=product_url,
+                description="\n".join(lines),
+                color=0x00ccff
+            )
+            embed.set_footer(text=f"Variant {product_code} · periods without changes are omitted")
+        else:
+            embed = discord.Embed(
+                title="📈 Stock History",
+                description=f"No history recorded for variant {product_code} in the last {days} days.",
+                color=0xffcc00
+            )
+    except Exception as e:
+        Logger.error('Error fetching stock history:', e)
+        embed = discord.Embed(
+            title="❌ Error",
+            description=f"An error occurred while fetching the stock history.\n{str(e)}",
+            color=0xff0000
+        )
+
+    await interaction.followup.send(embed=embed)
+
+
+@client.tree.command(name="tps-profile-sweep", description="Run a profiled stock sweep and attach the hot-path report")
+@app_commands.checks.has_permissions(administrator=True)
+async def profile_sweep(interaction: discord.Interaction):
+    Logger.info("Received profile sweep request")
+
+    if sweep_mode == 'sharded':
+        # Checks run in the sweep workers, a sweep here would race them for the same jobs
+        await interaction.response.send_message(
+            content="⚠️ Sweeps run in sharded workers, set `PROFILE_SWEEPS=true` on a worker to profile its passes."
+        )
+        return
+
+    if sweep_lock.locked():
+        await interaction.response.send_message(content="⚠️ A sweep is already running, try again once it finishes.")
+        return
+
+    # A large watch list can outlast the 15 minute interaction token, so the result goes to the channel
+    await interaction.response.send_message(
+        content="🔬 Profiled sweep started, the report will be posted in this channel when it finishes."
+    )
+    channel = interaction.channel
+
+    try:
+        await watch_stock_cron(client, profile=True)
+        report_path = SweepProfiler.last_report_path
+        await channel.send(
+            content=f"🔬 Profiled sweep requested by {interaction.user.mention} completed, "
+                    f"report saved to `{os.path.basename(report_path)}`",
+            file=discord.File(report_path)
+        )
+        return
+    except Exception as e:
+        Logger.error('Error profiling sweep:', e)
+        embed = discord.Embed(
+            title="❌ Error",
+            description=f"An error occurred while profiling the sweep.\n{str(e)}",
+            color=0xff0000
+        )
+
+    await channel.send(embed=embed)
+
+
+@client.tree.command(name="tps-loop-stats", description="Show event loop lag percentiles and recent stalls")
+@app_commands.checks.has_permissions(administrator=True)
+async def loop_stats(interaction: discord.Interaction):
+    Logger.info("Received loop stats request")
+    watchdog = LoopWatchdog()
+    percentiles = watchdog.get_percentiles()
+
+    if not percentiles:
+        await interaction.response.send_message(content="⚠️ The loop watchdog has no samples yet.", ephemeral=True)
+        return
+
+    embed = discord.Embed(
+        title="⏱️ Event Loop Lag",
+        description=f"p50 {percentiles['p50_ms']}ms · p90 {percentiles['p90_ms']}ms · "
+                    f"p99 {percentiles['p99_ms']}ms · max {percentiles['max_ms']}ms\n"
+                    f"{percentiles['samples']} samples, {percentiles['stalls']} stalls recorded",
+        color=0x00ccff
+    )
+    for stall in reversed(watchdog.get_recent_stalls()):
+        duration = f"{stall['duration_ms']}ms" if stall['duration_ms'] is not None else "ongoing"
+        embed.add_field(
+            name=f"{stall['detected_at'][:19]} · {duration}",
+            value=f"`{stall['location']}`"[:1024],
+            inline=False
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+@client.tree.command(name="tps-fetch-stats", description="Show fetch queue and latency stats per priority lane")
+@app_commands.checks.has_permissions(administrator=True)
+async def fetch_stats(interaction: discord.Interaction):
+    Logger.info("Received fetch stats request")
+    executor = FetchExecutor()
+
+    embed = discord.Embed(
+        title="🚦 Fetch Lanes",
+        description=f"{executor.MAX_CONCURRENCY} slots, {executor.RESERVED_INTERACTIVE_SLOTS} reserved for interactive commands",
+        color=0x00ccff
+    )
+    for lane, stats in executor.get_stats().items():
+        if stats['completed']:
+            latency = f"latency p50 {stats['latency_p50_ms']}ms · p90 {stats['latency_p90_ms']}ms · " \
+                      f"p99 {stats['latency_p99_ms']}ms\nqueued p50 {stats['wait_p50_ms']}ms · p99 {stats['wait_p99_ms']}ms"
+        else:
+            latency = "no completed fetches yet"
+        embed.add_field(
+            name=lane.capitalize(),
+            value=f"{stats['in_flight']} in flight · {stats['waiting']} waiting · {stats['completed']} completed · "
+                  f"{stats['promotions']} starvation promotions\n{latency}",
+            inline=False
+        )
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
 @tasks.loop(seconds=watch_product_cron_delay_seconds)
 async def watched_products_stock_cron():
     Logger.info("Starting scheduled stock check")
@@ -275,10 +689,28 @@ async def watched_products_stock_cron():
     Logger.info(f"Scheduled stock check completed. Next run in {watch_product_cron_delay_seconds} seconds.")
 
 
+@tasks.loop(seconds=notification_queue_poll_seconds)
+async def notification_queue_cron():
+    try:
+        await process_notification_jobs(client)
+        await process_alert_jobs(client)
+    except Exception as e:
+        # Keep polling, unsent notifications stay queued
+        Logger.error("Error draining notification queue", e)
+
+
 @client.event
 async def on_ready():
     Logger.info(f"Bot is ready and logged in as {client.user}")
-    watched_products_stock_cron.start()
+    if not startup_timer.reported and client.setup_finished_at is not None:
+        startup_timer.mark('gateway_ready', client.setup_finished_at)
+        startup_timer.report()
+    if not notification_queue_cron.is_running():
+        notification_queue_cron.start()
+    if sweep_mode == 'sharded':
+        Logger.info("Sharded sweep mode enabled, stock checks are left to sweep workers")
+    elif not watched_products_stock_cron.is_running():
+        watched_products_stock_cron.start()
 
 
 def run_bot():
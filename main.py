@@ -1,6 +1,7 @@
 from Logger import Logger
 from discord_bot import run_bot
 from DatabaseManager import DatabaseManager
+from SessionManager import SessionManager
 
 if __name__ == "__main__":
     db = DatabaseManager()
@@ -9,5 +10,7 @@ if __name__ == "__main__":
     except Exception as e:
         Logger.critical('Internal error occurred', e)
     finally:
+        SessionManager().save()
         db.close()
+        Logger.flush_suppressed()
         Logger.critical('Shutting down bot...')
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Dict, List, Optional
 
 
 class ProductOptions:
@@ -25,6 +25,19 @@ class ProductOptions:
             'ean': self.ean
         }
 
+    @staticmethod
+    def from_dict(data: Dict) -> 'ProductOptions':
+        return ProductOptions(
+            name=data['name'],
+            stock_level=data['stock_level'],
+            is_in_stock=data['is_in_stock'],
+            stock_status=data['stock_status'],
+            product_code=data['product_code'],
+            formatted_price=data['formatted_price'],
+            product_url=data['product_url'],
+            ean=data['ean']
+        )
+
 
 class ProductData:
     def __init__(self, name: str, product_code: str, options: List[ProductOptions],
@@ -41,3 +54,19 @@ class ProductData:
             'options': [option.to_dict() for option in self.options],
             'product_url': self.product_url
         }
+
+    def get_watched_option(self) -> Optional[ProductOptions]:
+        """Return the variant selected by the product URL's varSel, if present"""
+        for option in self.options:
+            if option.product_code == self.product_code:
+                return option
+        return None
+
+    @staticmethod
+    def from_dict(data: Dict) -> 'ProductData':
+        return ProductData(
+            name=data['name'],
+            product_code=data['product_code'],
+            options=[ProductOptions.from_dict(option) for option in data['options']],
+            product_url=data['product_url']
+        )
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+from BrowserPool import BrowserPool
+from DatabaseManager import DatabaseManager
+from Logger import Logger
+from LoopWatchdog import LoopWatchdog
+from SweepProfiler import SweepProfiler
+from watch_stock_cron import enqueue_check_jobs, process_check_jobs
+
+load_dotenv()
+
+sweep_shard_count = int(os.getenv('SWEEP_SHARD_COUNT', 16))
+sweep_lease_seconds = int(os.getenv('SWEEP_LEASE_SECONDS', 5 * 60))  # 5 minutes
+sweep_idle_poll_seconds = int(os.getenv('SWEEP_IDLE_POLL_SECONDS', 30))
+watch_product_cron_delay_seconds = int(os.getenv('WATCH_PRODUCT_CRON_DELAY_SECONDS', 60 * 60))  # 1 hour
+
+
+async def sweep_shard(db: DatabaseManager, worker_id: str, shard: int) -> bool:
+    """
+    Queue and drain check jobs for every product in a shard
+    Returns False if the lease was lost part way through
+    """
+    product_urls = db.get_watch_products_for_shard(shard, sweep_shard_count)
+    Logger.info(f"Worker {worker_id} sweeping shard {shard} with {len(product_urls)} products")
+
+    enqueue_check_jobs(product_urls, shard=shard)
+    completed = await process_check_jobs(
+        worker_id,
+        shard=shard,
+        keep_alive=lambda: db.renew_shard_lease(shard, worker_id, sweep_lease_seconds)
+    )
+    if not completed:
+        Logger.warn(f"Worker {worker_id} lost lease on shard {shard}, abandoning sweep")
+    return completed
+
+
+async def run_worker(worker_id: str):
+    LoopWatchdog().start()
+    db = DatabaseManager()
+    db.backfill_shard_keys()
+    Logger.info(f"Sweep worker {worker_id} started with {sweep_shard_count} shards")
+
+    try:
+        while True:
+            shard = db.claim_shard_lease(worker_id, sweep_shard_count, sweep_lease_seconds)
+            if shard is None:
+                await asyncio.sleep(sweep_idle_poll_seconds)
+                continue
+
+            async with SweepProfiler.capture(f'shard-{shard}-{os.getpid()}'):
+                completed = await sweep_shard(db, worker_id, shard)
+            if completed:
+                next_sweep_at = datetime.utcnow() + timedelta(seconds=watch_product_cron_delay_seconds)
+                db.release_shard_lease(shard, worker_id, next_sweep_at)
+    finally:
+        await BrowserPool().close()
+
+
+def worker_process(index: int):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    try:
+        asyncio.run(run_worker(worker_id))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        Logger.critical(f'Sweep worker {worker_id} crashed', e)
+        raise
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run sharded stock sweep workers")
+    parser.add_argument('--processes', type=int, default=1, help="Number of worker processes on this host")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        worker_process(0)
+    else:
+        # Spawn rather than fork so each worker opens its own MongoDB connection
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=worker_process, args=(i,)) for i in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -1,5 +1,6 @@
 import asyncio
-import random
+import re
+import time
 from urllib.parse import parse_qs, urlparse
 
 import discord
@@ -7,40 +8,77 @@ import pytz
 import aiohttp
 import json
 from datetime import datetime
-from typing import Tuple
+from typing import Dict, Optional, Tuple
 
+from CircuitBreaker import BANNED, HTTP_5XX, HTTP_OTHER, LAYOUT, NETWORK, OTHER, PARSE, PRODUCT, PRODUCT_FAILURES, \
+    CircuitBreaker, CircuitOpenError, FetchError
 from DatabaseManager import DatabaseManager
+from FetchExecutor import FetchExecutor
 from Logger import Logger
 from bs4 import BeautifulSoup
+from BrowserPool import BrowserPool
+from CaptureArchive import CaptureArchive
 from models import ProductData, ProductOptions
 from ProxyManager import ProxyManager
+from SessionManager import BAN_STATUSES, SessionManager
+from yarl import URL
 
-db = DatabaseManager()
-
-WINDOWS_USER_AGENTS = [
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Edg/121.0.0.0',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36 OPR/108.0.0.0',
-    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36 Vivaldi/6.5.3206.63'
-]
-
+# Browser-specific headers (user-agent, sec-ch-ua) come from the proxy's session fingerprint
 headers = {
     'accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
     'accept-language': 'en-US,en;q=0.7',
     'cache-control': 'max-age=0',
     'priority': 'u=0, i',
-    'sec-ch-ua': '"Chromium";v="130", "Brave";v="130", "Not?A_Brand";v="99"',
     'sec-ch-ua-mobile': '?0',
     'sec-ch-ua-platform': '"Windows"',
     'sec-fetch-dest': 'document',
     'sec-fetch-mode': 'navigate',
     'sec-fetch-site': 'same-origin',
     'sec-fetch-user': '?1',
-    'sec-gpc': '1',
     'upgrade-insecure-requests': '1',
-    'user-agent': random.choice(WINDOWS_USER_AGENTS),
 }
 
+SITE_URL = URL('https://www.theperfumeshop.com/')
+PRODUCT_URL_PREFIX = 'https://www.theperfumeshop.com/'
+
+APP_STATE_PATTERN = re.compile(
+    r'<script[^>]*\bid=["\']spartacus-app-state["\'][^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE
+)
+# Where cx-state.product.details.entities starts in the app state
+PRODUCT_ENTITIES_PATTERN = re.compile(r'"details"\s*:\s*\{\s*"entities"\s*:\s*')
+_json_decoder = json.JSONDecoder()
+
+# Failures of the aiohttp fetch that a real browser may get past, e.g. a JS challenge
+BROWSER_ESCALATION_FAILURES = {BANNED, LAYOUT}
+
+
+def _classify_failure(error: Exception) -> str:
+    if isinstance(error, FetchError):
+        return error.failure_class
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return NETWORK
+    if isinstance(error, (KeyError, IndexError, TypeError)):
+        # Unexpected shapes in the product JSON, more likely a schema change than one bad product
+        return PARSE
+    return OTHER
+
+
+def normalize_product_url(url: str) -> Optional[Tuple[str, str]]:
+    """
+    Return the canonical product URL and its variant code, or None if the URL is not a product URL
+    Tracking parameters and fragments are dropped so the same variant always maps to one URL
+    """
+    url = url.strip()
+    if not url.startswith(PRODUCT_URL_PREFIX):
+        return None
+
+    parsed_url = urlparse(url)
+    product_code = parse_qs(parsed_url.query).get('varSel', [None])[0]
+    if not product_code:
+        return None
+
+    return f"{PRODUCT_URL_PREFIX}{parsed_url.path.lstrip('/')}?varSel={product_code}", product_code
+
 
 def get_current_time():
     uk_tz = pytz.timezone('Europe/London')
@@ -81,101 +119,233 @@ def get_product_embed(product_data: ProductData) -> discord.Embed:
     return embed
 
 
-async def fetch_product_data(url: str, max_retries=5) -> Tuple[discord.Embed, ProductData | None]:
+def find_app_state(content: str) -> Optional[str]:
+    """Return the raw text of the spartacus-app-state script, or None if the page doesn't have one"""
+    match = APP_STATE_PATTERN.search(content)
+    if match is not None:
+        return match.group(1)
+
+    # Unusual markup, let the HTML parser find it
+    script_tag = BeautifulSoup(content, 'html.parser').find(id='spartacus-app-state')
+    return script_tag.string if script_tag else None
+
+
+def decode_product_entities(state: str, product_code: str) -> Dict:
+    """
+    Decode only cx-state.product.details.entities from the unescaped app state
+    The rest of the state (CMS, routing, translations) is skipped, falling back to decoding everything
+    if the subtree can't be found
+    """
+    for match in PRODUCT_ENTITIES_PATTERN.finditer(state):
+        try:
+            entities, _ = _json_decoder.raw_decode(state, match.end())
+        except json.JSONDecodeError:
+            continue
+        if isinstance(entities, dict) and 'value' in entities.get(product_code, {}).get('details', {}):
+            return entities
+
+    Logger.debug(f"Product entities for {product_code} not found by key, decoding the whole app state")
+    return json.loads(state)['cx-state']['product']['details']['entities']
+
+
+def parse_product_page(content: str, url: str) -> ProductData:
+    """Extract the product and its variants from a product page, raises FetchError if the page has no product data"""
+    # Locate the script tag with the product data
+    app_state = find_app_state(content)
+    if app_state is None:
+        raise FetchError(LAYOUT, 'Product data not found in the page')
+
+    # Find the specific item containing product code
+    parsed_url = urlparse(url)
+    query_params = parse_qs(parsed_url.query)
+    product_code = query_params.get('varSel')[0] if query_params.get('varSel') else None
+
+    # Process the script content as JSON
+    try:
+        cleaned_content = app_state.replace('&q;', '"').replace('&l;', '<').replace('&g;', '>')
+        data = decode_product_entities(cleaned_content, product_code)
+    except json.JSONDecodeError:
+        raise FetchError(PARSE, 'Failed to parse product JSON data')
+    except (KeyError, TypeError):
+        raise FetchError(LAYOUT, 'Product entities not found in the app state')
+
+    if product_code is None or product_code not in data:
+        # The only failure that is about this product rather than the site
+        raise FetchError(PRODUCT, f'Product {product_code} not found in the page')
+    details = data[product_code]['details']['value']
+    product_name = details['name']
+
+    options = details['variantMatrix']
+
+    # Process each option to extract variant information
+    options_data = []
+    for option in options:
+
+        try:
+            variant_name = f"{product_name} - {option['variantValueCategory']['name']}"
+        except (KeyError, IndexError):
+            variant_name = product_name
+
+        variant_option = option['variantOption']
+        variant_code = variant_option['code']
+        variant_ean = variant_option['ean']
+        variant_stock_level = variant_option['stock']['stockLevel']
+        variant_stock_status = variant_option['stock']['stockLevelStatus']
+        variant_formatted_price = variant_option['priceData']['formattedValue']
+        variant_product_url = f"https://www.theperfumeshop.com/{variant_option['url']}?varSel={variant_code}"
+
+        options_data.append(
+            ProductOptions(
+                name=variant_name,
+                stock_level=variant_stock_level,
+                is_in_stock=variant_stock_status != 'outOfStock',
+                stock_status=variant_stock_status,
+                product_code=variant_code,
+                formatted_price=variant_formatted_price,
+                product_url=variant_product_url,
+                ean=variant_ean
+            )
+        )
+
+    return ProductData(
+        name=product_name,
+        product_code=product_code,
+        options=options_data,
+        product_url=url
+    )
+
+
+def _parse_or_detect_challenge(content: str, url: str, proxy_http: str) -> ProductData:
+    try:
+        return parse_product_page(content, url)
+    except FetchError as e:
+        if e.failure_class == LAYOUT and SessionManager.is_challenge_page(content):
+            SessionManager().rotate(proxy_http, 'bot challenge page')
+            raise FetchError(BANNED, 'Bot challenge served instead of the product page')
+        raise
+
+
+async def _fetch_with_browser(url: str, breaker: CircuitBreaker) -> ProductData | None:
+    Logger.info(f'Escalating {url} to the browser fetch backend')
+    try:
+        started_at = time.perf_counter()
+        proxy, content = await BrowserPool().fetch(url)
+        await CaptureArchive().record(url, 200, content, time.perf_counter() - started_at, 'browser')
+        product_data = _parse_or_detect_challenge(content, url, proxy['http'])
+    except Exception as e:
+        Logger.error(f'Error fetching product data from {url} with the browser', e)
+        breaker.record_failure(_classify_failure(e), url)
+        return None
+
+    breaker.record_success()
+    DatabaseManager().add_or_update_proxy(proxy)
+    return product_data
+
+
+async def fetch_product_data(url: str, max_retries=5,
+                             lane: str = FetchExecutor.SCHEDULED) -> Tuple[discord.Embed, ProductData | None]:
     if not (url.startswith('https://www.theperfumeshop.com/') and '?varSel=' in url):
         raise ValueError(
             "Invalid URL. Must be a valid The Perfume Shop product URL containing '?varSel='. Eg: https://www.theperfumeshop.com/marc-jacobs/perfect/eau-de-parfum-gift-set/p/267910EDPXS?varSel=1298801")
 
+    breaker = CircuitBreaker()
+    if not breaker.before_fetch():
+        raise CircuitOpenError(breaker.seconds_until_probe())
+    # Only the canary settles the circuit, other fetches may still be finishing from before it opened
+    is_canary = breaker.state == CircuitBreaker.HALF_OPEN
+
+    succeeded = False
+    try:
+        async with FetchExecutor().slot(lane):
+            if breaker.state == CircuitBreaker.OPEN:
+                # The circuit opened while this fetch waited for a slot
+                raise CircuitOpenError(breaker.seconds_until_probe())
+            result = await _fetch_product_data(url, max_retries, breaker)
+        succeeded = result[1] is not None
+        return result
+    except FetchError as e:
+        if e.failure_class not in PRODUCT_FAILURES:
+            raise
+        # The site served a valid page, which is all a canary needs to show
+        succeeded = True
+        return discord.Embed(
+            title='Error',
+            description=f'No product data found at {url}. The product may have been removed or the varSel may be wrong',
+            color=0xff0000
+        ), None
+    finally:
+        if is_canary:
+            breaker.after_fetch(succeeded)
+
+
+async def _fetch_product_data(url: str, max_retries: int,
+                              breaker: CircuitBreaker) -> Tuple[discord.Embed, ProductData | None]:
     proxy_manager = ProxyManager()
     await proxy_manager.initialize()
+    session_manager = SessionManager()
+    capture = CaptureArchive()
 
+    escalate = False
     for attempt in range(max_retries):
         try:
             random_proxy = await proxy_manager.get_proxy()
-            Logger.info(f'Attempt {attempt + 1}: Fetching product data from {url} using proxy {random_proxy}')
+            Logger.info(f'Attempt {attempt + 1}: Fetching product data from {url} using proxy {random_proxy["proxy_address"]}')
+
+            # Reuse the cookies and fingerprint this proxy presented last time
+            browser_session = session_manager.get_session(random_proxy['http'])
+            cookie_jar = aiohttp.CookieJar()
+            cookie_jar.update_cookies(browser_session['cookies'], response_url=SITE_URL)
 
             conn = aiohttp.TCPConnector(ssl=True)
-            async with aiohttp.ClientSession(connector=conn) as session:
+            started_at = time.perf_counter()
+            async with aiohttp.ClientSession(connector=conn, cookie_jar=cookie_jar) as session:
                 async with session.get(
                         url,
-                        headers=headers,
-                        cookies={},
+                        headers={**headers, **browser_session['fingerprint']},
                         proxy=random_proxy['http'],
                         timeout=aiohttp.ClientTimeout(total=10)
                 ) as response:
+                    if capture.ENABLED:
+                        # Error pages are captured too, they show what a ban or outage looks like
+                        await capture.record(
+                            url, response.status, await response.text(), time.perf_counter() - started_at, 'aiohttp'
+                        )
+                    if response.status in BAN_STATUSES:
+                        session_manager.rotate(random_proxy['http'], f'HTTP {response.status}')
+                        raise FetchError(BANNED, f'HTTP error {response.status}')
+                    if response.status >= 500:
+                        raise FetchError(HTTP_5XX, f'HTTP error {response.status}')
                     if response.status != 200:
-                        raise Exception(f'HTTP error {response.status}')
+                        raise FetchError(HTTP_OTHER, f'HTTP error {response.status}')
 
                     content = await response.text()
 
-            # Parse the page content
-            soup = BeautifulSoup(content, 'html.parser')
-
-            # Locate the script tag with the product data
-            script_tag = soup.find(id='spartacus-app-state')
-            if not script_tag:
-                raise Exception('Product data not found in the page')
-
-            # Process the script content as JSON
-            try:
-                cleaned_content = script_tag.string.replace('&q;', '"').replace('&l;', '<').replace('&g;', '>')
-                data = json.loads(cleaned_content)['cx-state']['product']['details']['entities']
-            except json.JSONDecodeError:
-                raise Exception('Failed to parse product JSON data')
-
-            # Find the specific item containing product code
-            parsed_url = urlparse(url)
-            query_params = parse_qs(parsed_url.query)
-            product_code = query_params.get('varSel')[0] if query_params.get('varSel') else None
-
-            details = data[product_code]['details']['value']
-            product_name = details['name']
-
-            options = details['variantMatrix']
-
-            # Process each option to extract variant information
-            options_data = []
-            for option in options:
-
-                try:
-                    variant_name = f"{product_name} - {option['variantValueCategory']['name']}"
-                except (KeyError, IndexError):
-                    variant_name = product_name
-
-                variant_option = option['variantOption']
-                variant_code = variant_option['code']
-                variant_ean = variant_option['ean']
-                variant_stock_level = variant_option['stock']['stockLevel']
-                variant_stock_status = variant_option['stock']['stockLevelStatus']
-                variant_formatted_price = variant_option['priceData']['formattedValue']
-                variant_product_url = f"https://www.theperfumeshop.com/{variant_option['url']}?varSel={variant_code}"
-
-                options_data.append(
-                    ProductOptions(
-                        name=variant_name,
-                        stock_level=variant_stock_level,
-                        is_in_stock=variant_stock_status != 'outOfStock',
-                        stock_status=variant_stock_status,
-                        product_code=variant_code,
-                        formatted_price=variant_formatted_price,
-                        product_url=variant_product_url,
-                        ean=variant_ean
-                    )
-                )
-
-            product_data = ProductData(
-                name=product_name,
-                product_code=product_code,
-                options=options_data,
-                product_url=url
-            )
-            db.add_or_update_proxy(random_proxy)
+            session_manager.update_cookies(random_proxy['http'], {cookie.key: cookie.value for cookie in cookie_jar})
+            product_data = _parse_or_detect_challenge(content, url, random_proxy['http'])
+            breaker.record_success()
+            DatabaseManager().add_or_update_proxy(random_proxy)
             Logger.info(f'Successfully fetched product data from {url}', product_data.to_dict())
             return get_product_embed(product_data), product_data
         except Exception as e:
             Logger.error(f'Error fetching product data from {url}', e)
+            failure_class = _classify_failure(e)
+            breaker.record_failure(failure_class, url)
+            if failure_class in PRODUCT_FAILURES:
+                # Another proxy would get the same page
+                raise
+            escalate = escalate or failure_class in BROWSER_ESCALATION_FAILURES
+            if breaker.state == CircuitBreaker.OPEN:
+                # The site is down, further retries would only burn proxies
+                break
             continue
 
+    # Only pages a real browser could get past are worth the cost of one
+    if escalate and breaker.state != CircuitBreaker.OPEN and BrowserPool().available:
+        product_data = await _fetch_with_browser(url, breaker)
+        if product_data is not None:
+            Logger.info(f'Successfully fetched product data from {url} with the browser', product_data.to_dict())
+            return get_product_embed(product_data), product_data
+
     Logger.error(f'Error fetching product data from {url}')
     return discord.Embed(
         title='Error',
@@ -1,15 +1,204 @@
+import asyncio
+import os
+import socket
 import discord
 
 from datetime import datetime
-from DatabaseManager import DatabaseManager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from CircuitBreaker import CircuitBreaker, CircuitOpenError
+from FetchExecutor import FetchExecutor
+from JobQueue import JobQueue
 from Logger import Logger
-from utils import fetch_product_data
+from SessionManager import SessionManager
+from StockHistory import StockHistory
+from SweepProfiler import SweepProfiler
+from WatchRegistry import WatchRegistry
+from models import ProductData, ProductOptions
+from utils import fetch_product_data, get_current_time, get_product_embed
 
+check_jobs_batch_size = int(os.getenv('CHECK_JOBS_BATCH_SIZE', 10))
+notification_jobs_batch_size = int(os.getenv('NOTIFICATION_JOBS_BATCH_SIZE', 20))
+failed_job_retry_delay_seconds = int(os.getenv('FAILED_JOB_RETRY_DELAY_SECONDS', 60))
+alert_jobs_batch_size = int(os.getenv('ALERT_JOBS_BATCH_SIZE', 10))
+admin_channel_id = os.getenv('ADMIN_CHANNEL_ID')
+# Worker leases must be renewed more often than this while a sweep is paused
+circuit_pause_step_seconds = 30
+# Claims are renewed well within the visibility timeout while a check waits for a fetch slot
+claim_heartbeat_seconds = JobQueue.DEFAULT_VISIBILITY_TIMEOUT // 3
 
-async def watch_stock_cron(client: discord.Client):
+local_worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+# Keeps an on-demand sweep from overlapping the scheduled one
+sweep_lock = asyncio.Lock()
+
+
+async def check_product(product_url: str) -> Tuple[Optional[ProductData], Optional[ProductOptions]]:
+    """Fetch a watched product and return it with the option being watched"""
+    Logger.info(f"Checking stock for product: {product_url}")
+
+    # Fetch product data
+    with SweepProfiler.track_product(product_url):
+        _, product_data = await fetch_product_data(product_url, lane=FetchExecutor.SCHEDULED)
+
+    if product_data is None:
+        Logger.warn(f"Failed to fetch product data for URL: {product_url}. Skipping...")
+        return None, None
+
+    StockHistory().record(product_data)
+    option_to_watch = product_data.get_watched_option()
+
+    if option_to_watch is None:
+        Logger.warn(f"Could not find product option to watch for URL: {product_url}. Skipping...")
+        return product_data, None
+
+    Logger.info("Found product option to watch ", option_to_watch.to_dict())
+    return product_data, option_to_watch
+
+
+def enqueue_check_jobs(product_urls: List[str], shard: Optional[int] = None) -> int:
+    """Queue a check job for each product that doesn't already have one pending"""
+    queued = JobQueue().enqueue_many(
+        JobQueue.CHECKS,
+        [{"payload": {"product_url": url}, "dedupe_key": f"check:{url}"} for url in product_urls],
+        shard=shard
+    )
+    Logger.info(f"Queued {queued} check jobs ({len(product_urls) - queued} already pending)")
+    return queued
+
+
+async def process_check_jobs(worker_id: str, shard: Optional[int] = None,
+                             keep_alive: Optional[Callable[[], bool]] = None) -> bool:
+    """
+    Drain queued check jobs, handing in-stock products over to the notification queue
+    Returns False if `keep_alive` asked to stop before the queue was empty
+    """
+    try:
+        return await _drain_check_jobs(worker_id, shard, keep_alive)
+    finally:
+        StockHistory().flush()
+        SessionManager().save()
+
+
+async def _pause_for_circuit(jobs: List[Dict], keep_alive: Optional[Callable[[], bool]]) -> bool:
+    """
+    Put unprocessed jobs back until the circuit can be probed and wait for it
+    Returns False if `keep_alive` asked to stop while waiting
+    """
+    breaker = CircuitBreaker()
+    wait_seconds = breaker.seconds_until_probe()
+    for job in jobs:
+        JobQueue().release(job, delay_seconds=int(wait_seconds), count_attempt=False)
+
+    Logger.warn(f"Site circuit is open, pausing sweep for {wait_seconds:.0f}s")
+    while breaker.is_open():
+        await asyncio.sleep(min(breaker.seconds_until_probe(), circuit_pause_step_seconds))
+        if keep_alive is not None and not keep_alive():
+            return False
+    return True
+
+
+async def _drain_check_jobs(worker_id: str, shard: Optional[int], keep_alive: Optional[Callable[[], bool]]) -> bool:
+    job_queue = JobQueue()
+    breaker = CircuitBreaker()
+
+    while True:
+        jobs = job_queue.claim(JobQueue.CHECKS, worker_id, check_jobs_batch_size, shard=shard)
+        if not jobs:
+            return True
+
+        while jobs:
+            if keep_alive is not None and not keep_alive():
+                # Unprocessed jobs become visible again once their claim expires
+                return False
+
+            if breaker.is_open():
+                # Once the cooldown passes, the next claimed job becomes the canary
+                if not await _pause_for_circuit(jobs, keep_alive):
+                    return False
+                break
+
+            if breaker.state != CircuitBreaker.CLOSED:
+                # Let the canary settle the circuit before the rest of the batch goes out
+                await _process_check_job(jobs[0], worker_id)
+                jobs = jobs[1:]
+                continue
+
+            if SweepProfiler.is_capturing():
+                # tracemalloc peaks are process wide, checks must run one at a time to be told apart
+                await _process_check_job(jobs[0], worker_id)
+                jobs = jobs[1:]
+                continue
+
+            # The scheduled lane of the fetch executor bounds how many of these fetch at once
+            await asyncio.gather(*(_process_check_job(job, worker_id) for job in jobs))
+            jobs = []
+
+
+async def _renew_claim(job: Dict) -> None:
+    """Keep a check job claimed until cancelled, stopping once the claim has been lost"""
+    while True:
+        await asyncio.sleep(claim_heartbeat_seconds)
+        if not JobQueue().extend(job):
+            Logger.warn(f"Lost the claim on a running check job: {job.get('dedupe_key') or job['_id']}")
+            return
+
+
+async def _process_check_job(job: Dict, worker_id: str) -> None:
+    # Jobs checked one at a time may have waited long enough for their claim to lapse
+    if not JobQueue().extend(job):
+        return
+
+    # The fetch can wait on an executor slot for longer than the visibility timeout
+    heartbeat = asyncio.create_task(_renew_claim(job))
+    try:
+        await _check_claimed_job(job, worker_id)
+    finally:
+        heartbeat.cancel()
+
+
+async def _check_claimed_job(job: Dict, worker_id: str) -> None:
+    job_queue = JobQueue()
+    product_url = job["payload"]["product_url"]
     try:
-        db_manager = DatabaseManager()
-        watched_products = db_manager.get_all_watch_products()
+        product_data, option_to_watch = await check_product(product_url)
+
+        if option_to_watch is None or not option_to_watch.is_in_stock:
+            if option_to_watch is not None:
+                Logger.info(f"Product still out of stock: {product_url}")
+            job_queue.ack(job)
+            return
+
+        Logger.info(f"Product is now back in stock: {product_url}")
+        handed_over = job_queue.transfer(
+            job,
+            JobQueue.NOTIFICATIONS,
+            {
+                "product_url": product_url,
+                "product": product_data.to_dict(),
+                "found_by": worker_id,
+                "delivered_channels": []
+            },
+            dedupe_key=f"notify:{product_url}"
+        )
+        if handed_over and WatchRegistry().remove_watch_product(product_url):
+            Logger.info(f"Successfully removed in-stock product from watch list: {product_url}")
+    except CircuitOpenError:
+        # Another fetch tripped the circuit or took the canary slot, handled with the next batch
+        job_queue.release(job, delay_seconds=int(CircuitBreaker().seconds_until_probe()), count_attempt=False)
+    except Exception as e:
+        Logger.error(f"Error processing product {product_url}", e)
+        job_queue.release(job, delay_seconds=failed_job_retry_delay_seconds)
+
+
+async def watch_stock_cron(client: discord.Client, profile: bool = False):
+    async with sweep_lock:
+        async with SweepProfiler.capture('sweep', force=profile):
+            await _run_sweep()
+
+
+async def _run_sweep():
+    try:
+        watched_products = WatchRegistry().get_watch_products()
 
         if not watched_products:
             Logger.warn("No products currently being watched")
@@ -17,66 +206,135 @@ async def watch_stock_cron(client: discord.Client):
 
         Logger.info(f"Starting stock check for {len(watched_products)} watched products at {datetime.utcnow()}")
 
-        for product_url in watched_products:
-            try:
-                Logger.info(f"Checking stock for product: {product_url}")
+        enqueue_check_jobs(watched_products)
+        await process_check_jobs(local_worker_id)
 
-                # Fetch product data and create embed
-                embed, product_data = await fetch_product_data(product_url)
+    except Exception as e:
+        Logger.error("Critical error in watch_stock_cron", e)
+        raise e
 
-                if product_data is None:
-                    Logger.warn(f"Failed to fetch product data for URL: {product_url}. Skipping...")
-                    continue
 
-                option_to_watch = None
-                for opt in product_data.options:
-                    if opt.product_code == product_data.product_code:
-                        option_to_watch = opt
-                        break
+async def process_notification_jobs(client: discord.Client):
+    """Deliver queued restock alerts, retrying only the channels that have not received them yet"""
+    try:
+        job_queue = JobQueue()
 
-                Logger.info(f"Found product option to watch ", option_to_watch.to_dict())
+        while True:
+            jobs = job_queue.claim(JobQueue.NOTIFICATIONS, local_worker_id, notification_jobs_batch_size)
+            if not jobs:
+                return
 
-                if option_to_watch is None:
-                    Logger.warn(f"Could not find product option to watch for URL: {product_url}. Skipping...")
-                    continue
+            Logger.info(f"Processing {len(jobs)} queued notifications")
 
-                if option_to_watch.is_in_stock:
-                    Logger.info(f"Product is now back in stock: {product_url}")
+            for job in jobs:
+                product_url = job["payload"]["product_url"]
+                try:
+                    product_data = ProductData.from_dict(job["payload"]["product"])
+                    option_to_watch = product_data.get_watched_option()
+                    if option_to_watch is not None:
+                        message = f'@here [{option_to_watch.name}]({option_to_watch.product_url}) is now in stock!'
+                    else:
+                        # Retrying won't change the stored product, announce it without the option
+                        Logger.warn(f"Queued notification has no product option to watch: {product_url}")
+                        message = f'@here [{product_data.name}]({product_url}) is now in stock!'
 
-                    await notify_users(
+                    delivered = await notify_users(
                         client,
-                        embed,
-                        f'@here [{option_to_watch.name}]({option_to_watch.product_url}) is now in stock!'
+                        get_product_embed(product_data),
+                        message,
+                        skip_channel_ids=job["payload"].get("delivered_channels", []),
+                        on_delivered=lambda channel_id, job=job: job_queue.add_to_payload_set(
+                            job, "delivered_channels", channel_id
+                        )
                     )
+                    if not delivered:
+                        job_queue.release(job, delay_seconds=failed_job_retry_delay_seconds)
+                        continue
 
-                    if db_manager.remove_watch_product(product_url):
-                        Logger.info(f"Successfully removed in-stock product from watch list: {product_url}")
-                    else:
-                        Logger.warn(f"Failed to remove product from watch list: {product_url}")
-                else:
-                    Logger.info(f"Product still out of stock: {product_url}")
+                    # The check step removes the product too, this covers a crash in between
+                    WatchRegistry().remove_watch_product(product_url)
+                    job_queue.ack(job)
+                except Exception as e:
+                    Logger.error(f"Error processing notification for {product_url}", e)
+                    job_queue.release(job, delay_seconds=failed_job_retry_delay_seconds)
+                    continue
 
-            except Exception as e:
-                Logger.error(f"Error processing product {product_url}", e)
-                continue
+    except Exception as e:
+        Logger.error("Critical error in process_notification_jobs", e)
+        raise e
+
+
+async def process_alert_jobs(client: discord.Client):
+    """Deliver queued admin alerts, such as the site circuit opening or closing, to the admin channel"""
+    try:
+        job_queue = JobQueue()
+
+        while True:
+            jobs = job_queue.claim(JobQueue.ALERTS, local_worker_id, alert_jobs_batch_size)
+            if not jobs:
+                return
+
+            for job in jobs:
+                try:
+                    channel = client.get_channel(int(admin_channel_id)) if admin_channel_id else None
+                    if channel is None:
+                        Logger.warn("ADMIN_CHANNEL_ID is not set or not found, dropping admin alert", job["payload"])
+                        job_queue.ack(job)
+                        continue
+
+                    await channel.send(embed=get_alert_embed(job["payload"]))
+                    job_queue.ack(job)
+                except Exception as e:
+                    Logger.error("Error sending admin alert", e)
+                    job_queue.release(job, delay_seconds=failed_job_retry_delay_seconds)
+                    continue
 
     except Exception as e:
-        Logger.error(f"Critical error in watch_stock_cron", e)
+        Logger.error("Critical error in process_alert_jobs", e)
         raise e
 
 
-async def notify_users(client: discord.Client, embed: discord.Embed, message: str):
+def get_alert_embed(payload: Dict) -> discord.Embed:
+    details = payload.get("details", {})
+    if payload["state"] == CircuitBreaker.OPEN:
+        embed = discord.Embed(
+            title="🚨 The Perfume Shop appears to be down",
+            description="Product checks are paused and will resume automatically once a canary check succeeds.",
+            color=0xff0000
+        )
+    else:
+        embed = discord.Embed(
+            title="✅ The Perfume Shop is reachable again",
+            description="Product checks have resumed.",
+            color=0x00ff00
+        )
+
+    for name, value in details.items():
+        embed.add_field(name=name.replace('_', ' ').capitalize(), value=str(value), inline=True)
+    embed.set_footer(text=f"🕒 Time: {get_current_time()} (UK)")
+    return embed
+
+
+async def notify_users(client: discord.Client, embed: discord.Embed, message: str,
+                       skip_channel_ids: Iterable[str] = (),
+                       on_delivered: Optional[Callable[[str], None]] = None) -> bool:
+    """
+    Send a message to every notification channel not in `skip_channel_ids`
+    Returns False if any channel failed and should be retried
+    """
     try:
         Logger.info("Sending notifications to all channels")
-        db_manager = DatabaseManager()
-        channel_ids = db_manager.get_all_notification_channels()
+        channel_ids = WatchRegistry().get_notification_channels()
 
         if not channel_ids:
             Logger.warn("No notification channels configured")
-            return
+            return True
 
+        skip_channel_ids = set(skip_channel_ids)
+        channel_ids = [channel_id for channel_id in channel_ids if channel_id not in skip_channel_ids]
         Logger.info(f"Attempting to send notifications to {len(channel_ids)} channels")
 
+        all_delivered = True
         for channel_id in channel_ids:
             try:
                 channel = client.get_channel(int(channel_id))
@@ -93,10 +351,14 @@ async def notify_users(client: discord.Client, embed: discord.Embed, message: st
                     embed=embed if embed else None
                 )
                 Logger.info(f"Successfully sent notification to channel {channel_id}")
+                if on_delivered is not None:
+                    on_delivered(channel_id)
             except Exception as e:
                 Logger.error(f"Error sending notification to channel {channel_id}", e)
+                all_delivered = False
 
         Logger.info("Finished sending notifications")
+        return all_delivered
     except Exception as e:
         Logger.error("Critical error in notify_users", e)
         raise e